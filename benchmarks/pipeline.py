@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# File name          : pipeline.py
+# Author             : TomPh
+# Date created       : 29 May 2023
+
+"""
+Benchmark the CLI and the job pipeline against a local AWS stand-in: an in-process moto server,
+or any endpoint given with --endpoint-url such as LocalStack.
+Results are written as JSON to --output. With --baseline, exits with a non-zero status when a metric
+is worse than the baseline by more than --threshold.
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+# Runs the CLI like hashcloud.py. The image is not built against the stand-in, only the AWS calls of the setup are measured
+launcher = """
+import sys
+sys.argv = ['hashcloud.py'] + sys.argv[1:]
+if sys.argv[1] == 'setup':
+    from hashcloud.AWS_Resources import creation
+    creation.build_and_upload_image = lambda *args, **kwargs: True
+from hashcloud.__main__ import main
+main()
+"""
+
+credentials = {
+    'AWS_ACCESS_KEY_ID': 'testing',
+    'AWS_SECRET_ACCESS_KEY': 'testing',
+    'AWS_SESSION_TOKEN': 'testing',
+    'AWS_DEFAULT_REGION': 'us-east-1',
+}
+
+# Share of the seeded job history that is still running and refreshed by crack status.
+live_share = 0.01
+
+class StandIn:
+    """Start a moto server unless an endpoint is given, and run CLI commands against it in a work directory."""
+    def __init__(self, endpoint_url=None):
+        self.server = None
+        if not endpoint_url:
+            from moto.server import ThreadedMotoServer
+            logging.getLogger('werkzeug').setLevel(logging.ERROR)
+            # The setup attaches AWS managed policies, which moto only knows when asked to
+            os.environ['MOTO_IAM_LOAD_MANAGED_POLICIES'] = 'true'
+            self.server = ThreadedMotoServer(port=0, verbose=False)
+            self.server.start()
+            host, port = self.server.get_host_and_port()
+            endpoint_url = f"http://{host}:{port}"
+            # Batch jobs complete without starting containers
+            request = urllib.request.Request(
+                f"{endpoint_url}/moto-api/config", data=json.dumps({'batch': {'use_docker': False}}).encode(), method='POST'
+            )
+            urllib.request.urlopen(request).close()
+        self.endpoint_url = endpoint_url
+        os.environ.update({**credentials, 'AWS_ENDPOINT_URL': endpoint_url})
+
+        self.work_dir = tempfile.mkdtemp(prefix='hashcloud-bench-')
+        shutil.copy(os.path.join(root, 'config.json'), self.work_dir)
+        os.makedirs(os.path.join(self.work_dir, 'build'))
+
+    def path(self, *parts):
+        return os.path.join(self.work_dir, *parts)
+
+    def run(self, *args):
+        """Run a CLI command, returns its wall time in seconds."""
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, '-c', launcher, *args],
+            cwd=self.work_dir, env={**os.environ, 'PYTHONPATH': root},
+            stdout=subprocess.DEVNULL, check=True
+        )
+        return time.perf_counter() - start
+
+    def close(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+        if self.server:
+            self.server.stop()
+
+def metric(value, unit, better='lower'):
+    return {'value': round(value, 4), 'unit': unit, 'better': better}
+
+def write_wordlist(path, size, seed):
+    """Write a wordlist of about size bytes, seeded so each file has its own digest."""
+    line_count = size // 17
+    with open(path, 'w') as file:
+        for start in range(0, line_count, 100000):
+            file.write(''.join(f"{seed:04x}{i:012x}\n" for i in range(start, min(start + 100000, line_count))))
+
+def write_hashes(path, count, seed):
+    with open(path, 'w') as file:
+        file.write(''.join(f"{seed:08x}{i:024x}\n" for i in range(count)))
+
+def seed_jobs(stand_in, start, end):
+    """Add finished jobs to the job store, a few of them still running."""
+    from hashcloud import jobstore
+    jobstore.jobstore_path = stand_in.path('build', 'jobs.db')
+    submitted = int(time.time() * 1000)
+    jobs = []
+    for i in range(start, end):
+        live = i % int(1 / live_share) == 0
+        jobs.append((
+            f"bench-job-{i}", f"hashes/bench-{i}.txt", f"bench-{i}.txt", 'bench.txt', '-m 0', 1, 2048, 1, 0, 10,
+            submitted, 'RUNNING' if live else 'SUCCEEDED', submitted, submitted, None if live else submitted + 60000
+        ))
+    connection = jobstore.connect()
+    with connection:
+        connection.executemany(
+            "INSERT INTO jobs (id, file, file_name, wordlist, options, vcpu, memory, shards, hash_mode, hash_count, "
+            "submitted, status, created_at, started_at, stopped_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            jobs
+        )
+        connection.executemany(
+            "INSERT INTO job_files (job_id, file, file_name, hash_count) VALUES (?, ?, ?, ?)",
+            [(j[0], j[1], j[2], j[9]) for j in jobs]
+        )
+    connection.close()
+
+def seed_results(stand_in, count):
+    """Put a result object in the bucket for the first seeded jobs."""
+    import boto3
+    with open(stand_in.path('build', 'resources.json')) as file:
+        bucket_name = json.load(file)['bucket_name']
+    s3 = boto3.client('s3')
+    body = ''.join(f"{i:032x}:password{i}\n" for i in range(10)).encode()
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        list(executor.map(lambda i: s3.put_object(Bucket=bucket_name, Key=f"cracked/bench-{i}.txt", Body=body), range(count)))
+
+def create_batch_service_role():
+    """The setup reads the service-linked role of AWS Batch, which a fresh stand-in does not have."""
+    import boto3
+    iam = boto3.client('iam')
+    try:
+        iam.create_role(RoleName='AWSServiceRoleForBatch', AssumeRolePolicyDocument=json.dumps({
+            'Version': '2012-10-17',
+            'Statement': [{'Effect': 'Allow', 'Principal': {'Service': 'batch.amazonaws.com'}, 'Action': 'sts:AssumeRole'}]
+        }))
+    except iam.exceptions.EntityAlreadyExistsException:
+        pass
+
+def run_benchmarks(stand_in, sizes, job_counts, result_count, runs):
+    results = {}
+
+    create_batch_service_role()
+    results['setup_create'] = metric(stand_in.run('setup', 'create'), 's')
+    with open(stand_in.path('build', 'resources.json')) as file:
+        resources = json.load(file)
+    missing = [key for key in ('bucket_name', 'job_definition_arn', 'job_queue_arn') if key not in resources]
+    if missing:
+        raise RuntimeError(f"setup create did not complete against the stand-in, missing {', '.join(missing)}.")
+    print(f"setup create: {results['setup_create']['value']} s")
+
+    wordlist = None
+    for size_mb in sizes:
+        path = stand_in.path(f"bench-{size_mb}mb.txt")
+        write_wordlist(path, size_mb * 1024 * 1024, int(time.time()) % 0xffff)
+        seconds = stand_in.run('wordlists', 'upload', '-f', path)
+        size = os.path.getsize(path)
+        results[f"wordlists_upload_{size_mb}mb"] = metric(size / 1024 / 1024 / seconds, 'MB/s', better='higher')
+        print(f"wordlists upload {size_mb} MB: {results[f'wordlists_upload_{size_mb}mb']['value']} MB/s")
+        wordlist = wordlist or os.path.basename(path)
+        os.remove(path)
+
+    timings = []
+    for run in range(runs):
+        path = stand_in.path(f"hashes-{run}.txt")
+        write_hashes(path, 1000, run)
+        timings.append(stand_in.run('crack', 'initiate', '-f', path, '-w', wordlist, '--options', '-m 0'))
+    results['crack_initiate'] = metric(statistics.median(timings), 's')
+    print(f"crack initiate: {results['crack_initiate']['value']} s")
+
+    seeded = 0
+    for count in job_counts:
+        seed_jobs(stand_in, seeded, count)
+        seeded = count
+        timings = [stand_in.run('crack', 'status') for _ in range(runs)]
+        results[f"crack_status_{count}_jobs"] = metric(statistics.median(timings), 's')
+        print(f"crack status with {count} jobs: {results[f'crack_status_{count}_jobs']['value']} s")
+
+    seed_results(stand_in, min(result_count, seeded))
+    results['crack_result_all'] = metric(stand_in.run('crack', 'result', '--all'), 's')
+    print(f"crack result --all with {min(result_count, seeded)} results: {results['crack_result_all']['value']} s")
+
+    results['setup_cleanup'] = metric(stand_in.run('setup', 'cleanup'), 's')
+    print(f"setup cleanup: {results['setup_cleanup']['value']} s")
+    return results
+
+def compare(results, baseline, threshold):
+    """Print the change of each metric against the baseline, returns the names of the regressed ones."""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if not previous or not previous['value']:
+            continue
+        change = current['value'] / previous['value'] - 1
+        regressed = change > threshold if current['better'] == 'lower' else change < -threshold
+        print(f"{name:<32} {previous['value']:>10} -> {current['value']:>10} {current['unit']:<5} {change:+7.1%}{'  REGRESSION' if regressed else ''}")
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the CLI and the job pipeline against a local AWS stand-in.')
+    parser.add_argument('--endpoint-url', type=str, help='AWS endpoint to use instead of starting a moto server.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 16, 64], help='Sizes in MB of the uploaded wordlists.')
+    parser.add_argument('--jobs', type=int, nargs='+', default=[10, 100, 1000, 10000], help='Job history sizes crack status is timed with.')
+    parser.add_argument('--results', type=int, default=1000, help='Number of result files retrieved by crack result --all.')
+    parser.add_argument('--runs', type=int, default=3, help='Number of runs of the quick commands, their median is kept.')
+    parser.add_argument('--output', type=str, default='build/benchmarks/pipeline.json', help='File the results are written to.')
+    parser.add_argument('--baseline', type=str, help='Results of a previous run to compare with.')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Accepted relative slowdown before a metric counts as a regression.')
+    args = parser.parse_args()
+
+    stand_in = StandIn(args.endpoint_url)
+    try:
+        results = run_benchmarks(stand_in, args.sizes, sorted(args.jobs), args.results, args.runs)
+    finally:
+        stand_in.close()
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w') as file:
+        json.dump({
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': sys.version.split()[0],
+            'endpoint': args.endpoint_url or 'moto',
+            'metrics': results,
+        }, file, indent=4)
+    print(f"Results written to '{args.output}'.")
+
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            baseline = json.load(file)['metrics']
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"Regressions over {args.threshold:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# File name          : startup.py
+# Author             : TomPh
+# Date created       : 29 May 2023
+
+"""
+Measure the startup time of the CLI and check that parsing arguments does not import boto3.
+Exits with a non-zero status when the median startup time goes over --max-ms.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+commands = [
+    ['--help'],
+    ['crack', '--help'],
+    ['crack', 'initiate', '--help'],
+    ['wordlists', 'upload', '--help'],
+]
+
+# Heavy modules that must not be loaded before a command actually runs
+heavy_modules = ['boto3', 'botocore', 'docker', 'tabulate']
+
+check_imports = """
+import sys
+sys.argv = ['hashcloud.py'] + sys.argv[1:]
+try:
+    from hashcloud.__main__ import main
+    main()
+except SystemExit:
+    pass
+print(' '.join(m for m in {heavy_modules!r} if m in sys.modules), file=sys.stderr)
+"""
+
+def time_command(args, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, 'hashcloud.py'] + args, cwd=root, stdout=subprocess.DEVNULL, check=True)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+def loaded_heavy_modules(args):
+    result = subprocess.run(
+        [sys.executable, '-c', check_imports.format(heavy_modules=heavy_modules)] + args,
+        cwd=root, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+    )
+    return result.stderr.split()
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the CLI startup time.')
+    parser.add_argument('--runs', type=int, default=20, help='Number of runs per command.')
+    parser.add_argument('--max-ms', type=float, default=250, help='Maximum accepted median startup time in milliseconds.')
+    args = parser.parse_args()
+
+    failed = False
+    for command in commands:
+        median = time_command(command, args.runs)
+        loaded = loaded_heavy_modules(command)
+        print(f"{' '.join(command):<30} {median:8.1f} ms   heavy imports: {', '.join(loaded) or '-'}")
+        if median > args.max_ms or loaded:
+            failed = True
+
+    if failed:
+        print(f"Startup regression: median over {args.max_ms} ms or heavy modules imported at startup.")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# File name          : run.py
+# Author             : TomPh
+# Date created       : 29 May 2023
+
+# Entrypoint of the cracking container: run.py <hashcat options...> <s3 hash file> <s3 wordlist and/or mask>
+# The attack inputs follow the hash file in hashcat's order, e.g. <mask> <s3 wordlist> for -a 7.
+
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+# Wordlists are fetched with parallel ranged GETs of this size, a few parts ahead of what is consumed.
+download_part_size = 16 * 1024 * 1024
+download_workers = int(os.environ.get('DOWNLOAD_CONCURRENCY', 8))
+
+# Jobs run on the local machine get their own directory and session, the container uses /tmp.
+work_dir = os.environ.get('WORK_DIR', '/tmp')
+session = os.environ.get('HASHCAT_SESSION', 'hashcloud')
+session_dir = os.path.expanduser('~/.local/share/hashcat/sessions')
+decompressors = {'.zst': ['zstd', '-dc'], '.gz': ['gzip', '-dc']}
+# hashcat exits with 0 when hashes were cracked and 1 when the wordlist was exhausted.
+hashcat_success = (0, 1)
+# Seconds between the status lines of hashcat, each one is written to S3 as a progress record.
+status_interval = int(os.environ.get('STATUS_INTERVAL', 30))
+status_options = ['--status', '--status-json', f"--status-timer={status_interval}"]
+
+s3 = boto3.client('s3', config=Config(max_pool_connections=download_workers * 2, retries={'max_attempts': 10, 'mode': 'adaptive'}))
+timings = {}
+
+def log(message):
+    print(message, flush=True)
+
+def split_s3_path(path):
+    bucket, _, key = path[len('s3://'):].partition('/')
+    return bucket, key
+
+class timed:
+    """Record the duration of a phase of the job."""
+    def __init__(self, phase):
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = time.monotonic()
+
+    def __exit__(self, *exc):
+        timings[self.phase] = round(timings.get(self.phase, 0) + time.monotonic() - self.start, 3)
+
+def read_object(path, **kwargs):
+    bucket, key = split_s3_path(path)
+    return s3.get_object(Bucket=bucket, Key=key, **kwargs)['Body'].read()
+
+def download_object(path, destination):
+    """Download a small object, returns False if it does not exist."""
+    try:
+        data = read_object(path)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return False
+        raise
+    with open(destination, 'wb') as file:
+        file.write(data)
+    return True
+
+def upload_object(source, path):
+    bucket, key = split_s3_path(path)
+    s3.upload_file(source, bucket, key)
+
+def iter_reads(reads):
+    """Yield the content of (path, get_object arguments) reads in order, fetching the next ones concurrently."""
+    with ThreadPoolExecutor(max_workers=download_workers) as executor:
+        pending = deque()
+        for path, kwargs in reads:
+            pending.append(executor.submit(read_object, path, **kwargs))
+            if len(pending) >= download_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def iter_range(path, start, end):
+    """Yield the inclusive byte range of an object in order, fetching the next parts concurrently."""
+    parts = [(offset, min(offset + download_part_size, end + 1) - 1) for offset in range(start, end + 1, download_part_size)]
+    return iter_reads((path, {'Range': f"bytes={part_start}-{part_end}"}) for part_start, part_end in parts)
+
+def load_chunks(wordlist):
+    """Return the S3 paths of the chunks of a chunked wordlist, in the order of its version manifest."""
+    bucket, _ = split_s3_path(wordlist)
+    return [f"s3://{bucket}/{chunk['key']}" for chunk in json.loads(read_object(wordlist))['chunks']]
+
+def iter_wordlist(wordlist, chunks=None):
+    """Yield the wordlist to crack, or its shard, from its byte range or from its chunks."""
+    if chunks is None:
+        return iter_range(wordlist, *wordlist_range(wordlist))
+    # Shards of chunked wordlists are inclusive ranges of chunk indexes
+    start, end = wordlist_range(wordlist, len(chunks))
+    return iter_reads((path, {}) for path in chunks[start:end + 1])
+
+def wordlist_range(wordlist, chunk_count=None):
+    """
+    Return the inclusive byte range of the wordlist to crack, the shard of array job children.
+    Chunked wordlists use chunk indexes instead of bytes.
+    """
+    shards_path = os.environ.get('WORDLIST_SHARDS')
+    index = os.environ.get('AWS_BATCH_JOB_ARRAY_INDEX')
+    if shards_path and index is not None:
+        shard = read_object(shards_path).decode().splitlines()[int(index)]
+        log(f"SHARD: {index} ({shard})")
+        start, end = shard.split('-')
+        return int(start), int(end)
+    if chunk_count is not None:
+        return 0, chunk_count - 1
+    bucket, key = split_s3_path(wordlist)
+    return 0, s3.head_object(Bucket=bucket, Key=key)['ContentLength'] - 1
+
+def fetch_hashes(to_crack):
+    """Download the hash file, or every file of a packed job, returns the member files by name."""
+    members = {}
+    if os.environ.get('HASH_GROUP'):
+        paths = read_object(to_crack).decode().split()
+        os.makedirs(f"{work_dir}/members", exist_ok=True)
+        members = {path.split('/')[-1]: f"{work_dir}/members/{path.split('/')[-1]}" for path in paths}
+        with ThreadPoolExecutor(max_workers=download_workers) as executor:
+            list(executor.map(lambda path: download_object(path, members[path.split('/')[-1]]), paths))
+        with open(f"{work_dir}/tocrack.txt", 'wb') as output:
+            for member in members.values():
+                with open(member, 'rb') as file:
+                    output.write(file.read())
+    else:
+        download_object(to_crack, f"{work_dir}/tocrack.txt")
+    return members
+
+def fetch_wordlist(wordlist, destination, decompressor=None, chunks=None):
+    """Download the wordlist, or its shard, decompressing it on the fly when a decompressor is given."""
+    with open(destination, 'wb') as file:
+        if not decompressor:
+            for data in iter_wordlist(wordlist, chunks):
+                file.write(data)
+            return
+        unpack = subprocess.Popen(decompressor, stdin=subprocess.PIPE, stdout=file)
+        for data in iter_wordlist(wordlist, chunks):
+            unpack.stdin.write(data)
+        unpack.stdin.close()
+        if unpack.wait():
+            raise RuntimeError(f"Could not decompress '{wordlist}'.")
+
+def attack_mode(args):
+    for i, arg in enumerate(args):
+        if arg in ('-a', '--attack-mode') and i + 1 < len(args):
+            return int(args[i + 1])
+        if arg.startswith('--attack-mode='):
+            return int(arg.split('=', 1)[1])
+        if arg.startswith('-a') and arg[2:].isdigit():
+            return int(arg[2:])
+    return 0
+
+def hashcat_keyspace(args, hashcat_inputs):
+    """Return the base keyspace hashcat reports for the attack, or None when it cannot be computed."""
+    try:
+        result = subprocess.run(['hashcat', *args, '--keyspace', *hashcat_inputs], capture_output=True, check=True)
+        return int(result.stdout.split()[-1])
+    except (OSError, subprocess.CalledProcessError, ValueError, IndexError) as e:
+        log(f"Keyspace query failed: {e}")
+        return None
+
+def keyspace_slice(args, hashcat_inputs):
+    """
+    Return the --skip and --limit options of the keyspace slice of array job children. The slices are cut
+    from the keyspace hashcat reports for the attack, the estimate of the client is only a fallback, and
+    the last slice has no limit so the end of the keyspace is always covered.
+    """
+    slices = os.environ.get('KEYSPACE_SLICES')
+    index = os.environ.get('AWS_BATCH_JOB_ARRAY_INDEX')
+    if not slices or index is None:
+        return []
+    base = hashcat_keyspace(args, hashcat_inputs) or int(os.environ.get('KEYSPACE') or 0)
+    slices, index = int(slices), int(index)
+    skip = base * index // slices
+    if index == slices - 1:
+        log(f"SLICE: {index} (skip {skip}, base {base})")
+        return ['--skip', str(skip)]
+    limit = base * (index + 1) // slices - skip
+    log(f"SLICE: {index} (skip {skip}, limit {limit}, base {base})")
+    return ['--skip', str(skip), '--limit', str(limit)]
+
+def feed(process, wordlist, chunks=None):
+    """Stream a compressed wordlist into the stdin of its decompressor."""
+    with timed('wordlist'):
+        try:
+            for data in iter_wordlist(wordlist, chunks):
+                process.stdin.write(data)
+        except BrokenPipeError:
+            pass
+        finally:
+            process.stdin.close()
+
+def progress_record(status):
+    """Reduce a hashcat status to the speed, progress, recovered hashes and estimated end of the job."""
+    return {
+        'time': int(time.time()),
+        'speed': sum(device.get('speed', 0) for device in status.get('devices', [])),
+        'progress': status.get('progress', [0, 0]),
+        'recovered': status.get('recovered_hashes', [0, 0]),
+        'eta': status.get('estimated_stop'),
+    }
+
+def report_progress(stream, progress_path):
+    """Write the status lines of hashcat to S3 as progress records, other lines go to the log."""
+    bucket, key = split_s3_path(progress_path) if progress_path else (None, None)
+    for line in stream:
+        if not line.startswith(b'{'):
+            sys.stdout.buffer.write(line)
+            sys.stdout.flush()
+            continue
+        try:
+            record = progress_record(json.loads(line))
+        except ValueError:
+            continue
+        log(f"PROGRESS: {json.dumps(record)}")
+        if bucket:
+            try:
+                s3.put_object(Bucket=bucket, Key=key, Body=json.dumps(record).encode())
+            except Exception as e:
+                log(f"Progress upload failed: {e}")
+
+def sync_checkpoint(checkpoint, output):
+    """Upload the restore file and the partial output of the session."""
+    restore_file = os.path.join(session_dir, f"{session}.restore")
+    try:
+        if os.path.exists(restore_file):
+            upload_object(restore_file, f"{checkpoint}/{session}.restore")
+        if os.path.exists(output):
+            upload_object(output, f"{checkpoint}/output")
+    except Exception as e:
+        log(f"Checkpoint failed: {e}")
+
+def split_output(output, members, username=False):
+    """
+    Write the lines of the output to the file of each member whose hashes they crack. Members are matched
+    on their hash, without the user part of --username lines. Lines matching no member, as for modes whose
+    output differs from their hash lines, go to a result named after the output.
+    """
+    owners = {}
+    for name, member in members.items():
+        with open(member, 'rb') as file:
+            for line in file:
+                hash_value = line.rstrip(b'\r\n')
+                if username:
+                    hash_value = hash_value.split(b':', 1)[-1]
+                owners.setdefault(hash_value.lower(), []).append(name)
+    results = {}
+    unmatched = output.split('/')[-1]
+    if os.path.exists(output):
+        with open(output, 'rb') as file:
+            for line in file:
+                # The plain text can contain colons, try every prefix ending before one
+                position = len(line)
+                while (position := line.rfind(b':', 0, position)) != -1:
+                    names = owners.get(line[:position].lower())
+                    if names:
+                        for name in names:
+                            results.setdefault(name, []).append(line)
+                        break
+                else:
+                    results.setdefault(unmatched, []).append(line)
+    paths = {}
+    os.makedirs(f"{work_dir}/results", exist_ok=True)
+    for name, lines in results.items():
+        paths[name] = f"{work_dir}/results/{name}"
+        with open(paths[name], 'wb') as file:
+            file.writelines(lines)
+    return paths
+
+def upload_results(output, members, results_path, suffix, username=False):
+    """Upload the output, split per hash file for packed jobs. Returns False if an upload failed."""
+    uploads = split_output(output, members, username) if members else {}
+    if not members and os.path.exists(output):
+        uploads[output.split('/')[-1]] = output
+    succeeded = True
+    for name, path in uploads.items():
+        try:
+            upload_object(path, f"{results_path}/{name}{suffix}")
+        except Exception as e:
+            log(f"Upload of '{name}' failed: {e}")
+            succeeded = False
+    return succeeded
+
+def main(argv):
+    start = time.monotonic()
+    position = next(i for i, arg in enumerate(argv) if arg.startswith('s3://'))
+    args, to_crack, inputs = argv[:position], argv[position], argv[position + 1:]
+    wordlist = next((value for value in inputs if value.startswith('s3://')), None)
+    attack = attack_mode(args)
+    log(f"TO_CRACK: {to_crack}")
+    log(f"INPUTS: {' '.join(inputs)}")
+    log(f"ARGS: {' '.join(args)}")
+    bucket_name, _ = split_s3_path(to_crack)
+
+    suffix = ''
+    if (os.environ.get('WORDLIST_SHARDS') or os.environ.get('KEYSPACE_SLICES')) and os.environ.get('AWS_BATCH_JOB_ARRAY_INDEX') is not None:
+        suffix = f".shard{os.environ['AWS_BATCH_JOB_ARRAY_INDEX']}"
+    output = f"{work_dir}/{to_crack.split('/')[-1]}"
+    os.makedirs(session_dir, exist_ok=True)
+    checkpoint = f"s3://{bucket_name}/checkpoints/{os.environ['CHECKPOINT_ID']}{suffix}" if os.environ.get('CHECKPOINT_ID') else None
+    # Array job children run as <job ID>:<index>, the records of a job are under progress/<job ID>/
+    progress_path = None
+    if os.environ.get('AWS_BATCH_JOB_ID'):
+        job_id = os.environ['AWS_BATCH_JOB_ID'].split(':')[0]
+        progress_path = f"s3://{bucket_name}/progress/{job_id}/{os.environ.get('AWS_BATCH_JOB_ARRAY_INDEX', 0)}.json"
+    decompressor = None
+    chunks = None
+    if wordlist and os.environ.get('WORDLIST_CHUNKS'):
+        # The wordlist is the manifest of a chunked version, its chunks are compressed frames or raw text
+        chunks = load_chunks(wordlist)
+        if chunks:
+            decompressor = next((command for extension, command in decompressors.items() if chunks[0].endswith(extension)), None)
+    elif wordlist:
+        decompressor = next((command for extension, command in decompressors.items() if wordlist.endswith(extension)), None)
+    # Only straight attacks can read the wordlist from stdin, hybrid attacks need it as a file
+    stream = decompressor and attack == 0
+    hashcat_inputs = [f"{work_dir}/wordlist.txt" if value == wordlist else value for value in inputs]
+
+    def fetch_hashes_timed():
+        with timed('hashes'):
+            return fetch_hashes(to_crack)
+
+    def fetch_wordlist_timed():
+        with timed('wordlist'):
+            fetch_wordlist(wordlist, f"{work_dir}/wordlist.txt", decompressor, chunks)
+
+    def fetch_checkpoint():
+        # Resume from the checkpoint of a previous attempt, hashcat appends to the partial output
+        with timed('checkpoint'):
+            if download_object(f"{checkpoint}/output", output):
+                log(f"RESUMING: {checkpoint}")
+            return download_object(f"{checkpoint}/{session}.restore", os.path.join(session_dir, f"{session}.restore"))
+
+    # Fetch the inputs concurrently, compressed wordlists are streamed once hashcat has started
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        members = executor.submit(fetch_hashes_timed)
+        restore = executor.submit(fetch_checkpoint) if checkpoint else None
+        if wordlist and not stream:
+            executor.submit(fetch_wordlist_timed).result()
+        members = members.result()
+        restore = restore.result() if restore else False
+    if not restore:
+        args = args + keyspace_slice(args, hashcat_inputs)
+
+    hashcat_start = time.monotonic()
+    if stream:
+        # hashcat cannot restore a session reading its wordlist from stdin
+        unpack = subprocess.Popen(decompressor, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        hashcat = subprocess.Popen(
+            ['hashcat', *args, *status_options, '--session', session, '-o', output, f"{work_dir}/tocrack.txt"],
+            stdin=unpack.stdout, stdout=subprocess.PIPE
+        )
+        unpack.stdout.close()
+        threading.Thread(target=feed, args=(unpack, wordlist, chunks), daemon=True).start()
+    elif restore:
+        # The status options are restored with the rest of the session
+        hashcat = subprocess.Popen(['hashcat', '--session', session, '--restore'], stdout=subprocess.PIPE)
+    else:
+        hashcat = subprocess.Popen(
+            ['hashcat', *args, *status_options, '--session', session, '-o', output, f"{work_dir}/tocrack.txt", *hashcat_inputs],
+            stdout=subprocess.PIPE
+        )
+    reporter = threading.Thread(target=report_progress, args=(hashcat.stdout, progress_path), daemon=True)
+    reporter.start()
+
+    stop = threading.Event()
+    if checkpoint:
+        interval = int(os.environ.get('CHECKPOINT_INTERVAL', 60))
+        def sync_loop():
+            while not stop.wait(interval):
+                sync_checkpoint(checkpoint, output)
+        threading.Thread(target=sync_loop, daemon=True).start()
+
+    # Fargate Spot sends SIGTERM before reclaiming the task: stop hashcat cleanly and save a last checkpoint
+    def on_term(signum, frame):
+        stop.set()
+        hashcat.send_signal(signal.SIGINT)
+        hashcat.wait()
+        if checkpoint:
+            sync_checkpoint(checkpoint, output)
+        sys.exit(143)
+    signal.signal(signal.SIGTERM, on_term)
+
+    returncode = hashcat.wait()
+    reporter.join()
+    stop.set()
+    timings['hashcat'] = round(time.monotonic() - hashcat_start, 3)
+    log(f"HASHCAT EXIT: {returncode}")
+
+    # Results are uploaded whatever the exit code, a failed run can still have cracked hashes
+    with timed('upload'):
+        uploaded = upload_results(output, members, f"s3://{bucket_name}/cracked", suffix, '--username' in args)
+    if checkpoint and uploaded and returncode in hashcat_success:
+        bucket, prefix = split_s3_path(checkpoint)
+        objects = s3.list_objects_v2(Bucket=bucket, Prefix=f"{prefix}/").get('Contents', [])
+        if objects:
+            s3.delete_objects(Bucket=bucket, Delete={'Objects': [{'Key': obj['Key']} for obj in objects]})
+
+    timings['total'] = round(time.monotonic() - start, 3)
+    log(f"TIMINGS: {json.dumps(timings)}")
+    if not uploaded:
+        return 1
+    if returncode in hashcat_success:
+        return 0
+    # Negative codes are signals, which are not valid exit statuses
+    return returncode if returncode > 0 else 1
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -4,15 +4,19 @@
 # Author             : TomPh
 # Date created       : 29 May 2023
 
-import boto3
 import json
+import os
 import subprocess
 import docker
 import base64
-import time
+import hashlib
+
+from hashcloud import clients
+from hashcloud.backends import batch as batch_backend
+from hashcloud.AWS_Resources import provisioning
 
 def create_s3_bucket(bucket_name):
-    s3 = boto3.client('s3')
+    s3 = clients.client('s3')
     s3.create_bucket(
         Bucket=bucket_name,
         ACL='private'
@@ -22,7 +26,7 @@ def create_s3_bucket(bucket_name):
     return  bucket_name
 
 def create_iam_role(role_name, bucket_name):
-    iam = boto3.client('iam')
+    iam = clients.client('iam')
     role_response = iam.create_role(
         RoleName=role_name,
         AssumeRolePolicyDocument=json.dumps({
@@ -60,8 +64,8 @@ def create_iam_role(role_name, bucket_name):
     return role_name, role_arn
 
 
-def create_batch_job_definition(job_definition_name, job_role_arn, execution_role_arn, container_image, command):
-    batch = boto3.client('batch')
+def create_batch_job_definition(job_definition_name, job_role_arn, execution_role_arn, container_image, command, attempts=3):
+    batch = clients.client('batch')
     response = batch.register_job_definition(
         jobDefinitionName=job_definition_name,
         type='container',
@@ -85,31 +89,31 @@ def create_batch_job_definition(job_definition_name, job_role_arn, execution_rol
                     'type': 'MEMORY'
                 },
             ],
-        }
+        },
+        # Fargate Spot reclaims are retried, the container resumes from its last checkpoint
+        retryStrategy=batch_backend.retry_strategy(attempts)
     )
 
     job_definition_arn = response['jobDefinitionArn']
     print(f"Batch job definition '{job_definition_name}' created successfully.")
     return job_definition_arn
 
-def create_batch_job_queue(job_queue_name, compute_environment_order):
-    batch = boto3.client('batch')
-    compute_environment_arn = compute_environment_order[0]['computeEnvironment']
+def create_batch_job_queue(job_queue_name, compute_environment_order, priority=1):
+    batch = clients.client('batch')
+    compute_environment_arns = [order['computeEnvironment'] for order in compute_environment_order]
+
+    def compute_environments_valid():
+        response = batch.describe_compute_environments(computeEnvironments=compute_environment_arns)
+        return len(response['computeEnvironments']) == len(compute_environment_arns) and all(
+            ce['status'] == 'VALID' for ce in response['computeEnvironments']
+        )
 
-    while True:
-        response = batch.describe_compute_environments(computeEnvironments=[compute_environment_arn])
-        status = response['computeEnvironments'][0]['status']
-        
-        if status == 'VALID':
-            break
-        
-        print(f"Waiting for compute environment '{compute_environment_arn}' to be in a valid state...")
-        time.sleep(5)
+    provisioning.wait_until(compute_environments_valid, f"compute environments of '{job_queue_name}' to be in a valid state")
 
     response = batch.create_job_queue(
         jobQueueName=job_queue_name,
         state='ENABLED',
-        priority=1,
+        priority=priority,
         computeEnvironmentOrder=compute_environment_order
     )
 
@@ -118,15 +122,16 @@ def create_batch_job_queue(job_queue_name, compute_environment_order):
     return job_queue_arn
 
 
-def create_batch_compute_environment(compute_environment_name, service_role_arn, subnet_ids, security_group_ids):
-    batch = boto3.client('batch')
+def create_batch_compute_environment(compute_environment_name, service_role_arn, subnet_ids, security_group_ids,
+                                     compute_type='FARGATE_SPOT', max_vcpus=256):
+    batch = clients.client('batch')
     response = batch.create_compute_environment(
         computeEnvironmentName=compute_environment_name,
         type='MANAGED',
         state='ENABLED',
         computeResources={
-            'type': 'FARGATE_SPOT',
-            'maxvCpus': 256,
+            'type': compute_type,
+            'maxvCpus': max_vcpus,
             'subnets': subnet_ids,
             'securityGroupIds': security_group_ids,
         },
@@ -138,7 +143,7 @@ def create_batch_compute_environment(compute_environment_name, service_role_arn,
     return compute_environment_arn
 
 def create_subnet(vpc_id, cidr_block):
-    ec2 = boto3.client('ec2')
+    ec2 = clients.client('ec2')
     response = ec2.create_subnet(
         VpcId=vpc_id,
         CidrBlock=cidr_block
@@ -150,7 +155,7 @@ def create_subnet(vpc_id, cidr_block):
     return subnet_id
 
 def create_security_group(group_name, description, vpc_id):
-    ec2 = boto3.client('ec2')
+    ec2 = clients.client('ec2')
     response = ec2.create_security_group(
         GroupName=group_name,
         Description=description,
@@ -162,21 +167,40 @@ def create_security_group(group_name, description, vpc_id):
 
     return group_id
 
-def build_and_upload_image(dockerfile_path, ecr_repository_name, aws_region, image_name):
-    client = docker.from_env()
+def build_context_digest(dockerfile_path):
+    """Compute a digest of every file in the Docker build context."""
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(dockerfile_path):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            digest.update(os.path.relpath(path, dockerfile_path).encode() + b'\0')
+            with open(path, 'rb') as file:
+                digest.update(hashlib.sha256(file.read()).digest())
+    return digest.hexdigest()
+
+def find_image_tags(ecr, ecr_repository_name, tag):
+    """Return all tags of the image holding the given tag in ECR, or None if there is no such image."""
     try:
-        image, build_logs = client.images.build(path=dockerfile_path, tag=image_name, rm=True)
-        for log in build_logs:
-            print(log)
-        
-        print(f"Docker image '{image_name}' built successfully.")
-        
-    except docker.errors.BuildError as e:
-        print(f"Failed to build Docker image: {str(e)}")
-        return False
+        response = ecr.describe_images(repositoryName=ecr_repository_name, imageIds=[{'imageTag': tag}])
+    except ecr.exceptions.ImageNotFoundException:
+        return None
+    return response['imageDetails'][0].get('imageTags', [])
+
+def build_and_upload_image(dockerfile_path, ecr_repository_name, aws_region, image_name):
+    ecr = clients.client('ecr', region_name=aws_region)
+
+    # Skip the build and push when ECR already holds an image of this exact build context
+    context_tag = f"context-{build_context_digest(dockerfile_path)[:32]}"
+    tags = find_image_tags(ecr, ecr_repository_name, context_tag)
+    if tags is not None:
+        if 'latest' not in tags:
+            manifest = ecr.batch_get_image(repositoryName=ecr_repository_name, imageIds=[{'imageTag': context_tag}])['images'][0]['imageManifest']
+            ecr.put_image(repositoryName=ecr_repository_name, imageManifest=manifest, imageTag='latest')
+        print(f"Docker image '{context_tag}' is already in ECR repository '{ecr_repository_name}', skipping build.")
+        return True
 
     # Authenticate to the ECR registry
-    ecr = boto3.client('ecr', region_name=aws_region)
     response = ecr.get_authorization_token()
     authorization_data = response['authorizationData'][0]
     registry = authorization_data['proxyEndpoint']
@@ -185,25 +209,45 @@ def build_and_upload_image(dockerfile_path, ecr_repository_name, aws_region, ima
     password = token.split(':')[1]
     subprocess.run(['docker', 'login', '-u', username, '-p', password, registry], check=True)
 
-    # Tag the Docker image
-    registry = registry.strip("https://")
+    registry = registry.replace("https://", "")
     image_tag = f"{registry}/{ecr_repository_name}:latest"
+
+    # Build with BuildKit, reusing the layers of the previously pushed image
+    try:
+        subprocess.run([
+            'docker', 'build',
+            '--build-arg', 'BUILDKIT_INLINE_CACHE=1',
+            '--cache-from', image_tag,
+            '--label', f"hashcloud.context={context_tag}",
+            '-t', image_name,
+            dockerfile_path
+        ], check=True, env={**os.environ, 'DOCKER_BUILDKIT': '1'})
+        print(f"Docker image '{image_name}' built successfully.")
+    except subprocess.CalledProcessError as e:
+        print(f"Failed to build Docker image: {str(e)}")
+        return False
+
+    # Tag the Docker image
     client = docker.from_env()
     image = client.images.get(image_name)
     image.tag(image_tag)
+    image.tag(f"{registry}/{ecr_repository_name}:{context_tag}")
 
     # Push the Docker image to ECR
     try:
-        push_logs = client.images.push(repository=image_tag)
-        print(push_logs)
+        for tag in ('latest', context_tag):
+            push_logs = client.images.push(repository=f"{registry}/{ecr_repository_name}", tag=tag)
+            print(push_logs)
         print(f"Docker image '{image_tag}' pushed to ECR successfully.")
     except docker.errors.APIError as e:
         print(f"Failed to push Docker image to ECR: {str(e)}")
+        return False
 
     print(f"Docker image '{image_tag}' built and uploaded to ECR repository '{ecr_repository_name}'.")
+    return True
 
 def create_ecr_repository(repository_name):
-    ecr = boto3.client('ecr')
+    ecr = clients.client('ecr')
     response = ecr.create_repository(
         repositoryName=repository_name
     )
@@ -4,19 +4,45 @@
 # Author             : TomPh
 # Date created       : 29 May 2023
 
-import boto3
-import time
+from concurrent.futures import ThreadPoolExecutor
+
+from hashcloud import clients
+from hashcloud.AWS_Resources import provisioning
+
+delete_workers = 16
+
+def empty_s3_bucket(bucket_name):
+    """Delete every object version and delete marker with concurrent 1000-key batches."""
+    s3 = clients.client('s3')
+
+    def delete_batch(objects):
+        response = s3.delete_objects(Bucket=bucket_name, Delete={'Objects': objects, 'Quiet': True})
+        for error in response.get('Errors', []):
+            print(f"Failed to delete '{error['Key']}': {error['Message']}")
+        return len(objects)
+
+    paginator = s3.get_paginator('list_object_versions')
+    with ThreadPoolExecutor(max_workers=delete_workers) as executor:
+        futures = []
+        for page in paginator.paginate(Bucket=bucket_name, PaginationConfig={'PageSize': 1000}):
+            objects = [
+                {'Key': version['Key'], 'VersionId': version['VersionId']}
+                for version in page.get('Versions', []) + page.get('DeleteMarkers', [])
+            ]
+            # A page can hold up to 1000 versions and 1000 delete markers
+            for i in range(0, len(objects), 1000):
+                futures.append(executor.submit(delete_batch, objects[i:i + 1000]))
+        deleted = sum(future.result() for future in futures)
+    print(f"Deleted {deleted} objects from S3 bucket '{bucket_name}'.")
 
 def delete_s3_bucket(bucket_name):
-    s3 = boto3.resource('s3')
-    bucket = s3.Bucket(bucket_name)
-    bucket.objects.all().delete()
-    s3 = boto3.client('s3')
+    empty_s3_bucket(bucket_name)
+    s3 = clients.client('s3')
     s3.delete_bucket(Bucket=bucket_name)
     print(f"S3 bucket '{bucket_name}' deleted successfully.")
 
 def delete_iam_role(role_name):
-    iam = boto3.client('iam')
+    iam = clients.client('iam')
     iam.detach_role_policy(RoleName=role_name, PolicyArn='arn:aws:iam::aws:policy/AmazonS3FullAccess')
     iam.detach_role_policy(RoleName=role_name, PolicyArn='arn:aws:iam::aws:policy/CloudWatchLogsFullAccess')
     iam.detach_role_policy(RoleName=role_name, PolicyArn='arn:aws:iam::aws:policy/service-role/AmazonECSTaskExecutionRolePolicy')
@@ -25,7 +51,7 @@ def delete_iam_role(role_name):
     print(f"IAM role '{role_name}' deleted successfully.")
 
 def delete_batch_job_definition(job_definition_arn):
-    batch = boto3.client('batch')
+    batch = clients.client('batch')
     batch.deregister_job_definition(
         jobDefinition=job_definition_arn
     )
@@ -33,52 +59,51 @@ def delete_batch_job_definition(job_definition_arn):
     print(f"Batch job definition '{job_definition_arn}' deleted successfully.")
 
 def delete_batch_job_queue(job_queue_arn):
-    batch = boto3.client('batch')
+    batch = clients.client('batch')
     batch.update_job_queue(
         jobQueue=job_queue_arn,
         state='DISABLED'
     )
 
-    while True:
+    def job_queue_status():
         response = batch.describe_job_queues(jobQueues=[job_queue_arn])
-        status = response['jobQueues'][0]['status']
-        
-        if status == 'VALID':
-            break
-        print("Waiting")
-        time.sleep(5)
+        return response['jobQueues'][0]['status'] if response['jobQueues'] else 'DELETED'
+
+    provisioning.wait_until(lambda: job_queue_status() == 'VALID', f"job queue '{job_queue_arn}' to be disabled")
 
     batch.delete_job_queue(
         jobQueue=job_queue_arn
     )
 
+    # The compute environment can only be deleted once no queue uses it
+    provisioning.wait_until(lambda: job_queue_status() == 'DELETED', f"job queue '{job_queue_arn}' to be deleted")
+
     print(f"Batch job queue '{job_queue_arn}' deleted successfully.")
 
 def delete_batch_compute_environment(compute_environment_arn):
-    batch = boto3.client('batch')
+    batch = clients.client('batch')
     batch.update_compute_environment(
         computeEnvironment=compute_environment_arn,
         state='DISABLED'
     )
 
-    while True:
+    def compute_environment_status():
         response = batch.describe_compute_environments(computeEnvironments=[compute_environment_arn])
-        status = response['computeEnvironments'][0]['status']
-        
-        if status == 'VALID':
-            break
-        
-        print(f"Waiting for compute environment '{compute_environment_arn}' to be in a valid state...")
-        time.sleep(5)
+        return response['computeEnvironments'][0]['status'] if response['computeEnvironments'] else 'DELETED'
+
+    provisioning.wait_until(lambda: compute_environment_status() == 'VALID', f"compute environment '{compute_environment_arn}' to be disabled")
 
     batch.delete_compute_environment(
         computeEnvironment=compute_environment_arn
     )
 
+    # The subnet and security group stay in use until the environment is gone
+    provisioning.wait_until(lambda: compute_environment_status() == 'DELETED', f"compute environment '{compute_environment_arn}' to be deleted")
+
     print(f"Batch compute environment '{compute_environment_arn}' deleted successfully.")
 
 def delete_subnet(subnet_id):
-    ec2 = boto3.client('ec2')
+    ec2 = clients.client('ec2')
     ec2.delete_subnet(
         SubnetId=subnet_id
     )
@@ -86,7 +111,7 @@ def delete_subnet(subnet_id):
     print(f"Subnet '{subnet_id}' deleted successfully.")
 
 def delete_security_group(group_id):
-    ec2 = boto3.client('ec2')
+    ec2 = clients.client('ec2')
     ec2.delete_security_group(
         GroupId=group_id
     )
@@ -94,7 +119,7 @@ def delete_security_group(group_id):
     print(f"Security group '{group_id}' deleted successfully.")
 
 def delete_ecr_repository(repository_name):
-    ecr = boto3.client('ecr')
+    ecr = clients.client('ecr')
     ecr.delete_repository(
         repositoryName=repository_name,
         force=True
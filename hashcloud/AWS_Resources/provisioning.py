@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# File name          : provisioning.py
+# Author             : TomPh
+# Date created       : 29 May 2023
+
+import random
+import time
+from tabulate import tabulate
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+def wait_until(check, description, initial_delay=1, max_delay=15, timeout=900):
+    """Poll check() with exponential backoff and jitter until it returns True."""
+    delay = initial_delay
+    deadline = time.monotonic() + timeout
+    while not check():
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Timed out waiting for {description}.")
+        print(f"Waiting for {description}...")
+        time.sleep(random.uniform(delay / 2, delay))
+        delay = min(delay * 2, max_delay)
+
+def _timed(func):
+    start = time.monotonic()
+    func()
+    return time.monotonic() - start
+
+def run_graph(steps, workers=8):
+    """
+    Run steps concurrently as soon as their dependencies have completed.
+    steps maps a step name to a (dependencies, function) tuple.
+    Returns the duration of each completed step in seconds, raises once all runnable steps are done if any failed.
+    """
+    timings = {}
+    failed = {}
+    running = {}
+    scheduled = set()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            for name, (dependencies, func) in steps.items():
+                if name in scheduled or not all(d in timings for d in dependencies):
+                    continue
+                scheduled.add(name)
+                running[executor.submit(_timed, func)] = name
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    timings[name] = future.result()
+                except Exception as e:
+                    print(f"Step '{name}' failed: {e}")
+                    failed[name] = e
+
+    print(tabulate(sorted(timings.items(), key=lambda t: -t[1]), headers=['Step', 'Seconds'], floatfmt='.1f'))
+    skipped = [name for name in steps if name not in scheduled]
+    if failed or skipped:
+        raise RuntimeError(f"Failed steps: {', '.join(failed) or '-'}; not run: {', '.join(skipped) or '-'}")
+    return timings
@@ -4,24 +4,32 @@
 # Author             : TomPh
 # Date created       : 29 May 2023
 
-import boto3
 import json
 import os
 
+from hashcloud import clients
+from hashcloud import settings
 from hashcloud.AWS_Resources import creation
 from hashcloud.AWS_Resources import deletion
+from hashcloud.AWS_Resources import provisioning
+
+# Job queues of each priority: Batch priority, and whether jobs may spill over to on-demand Fargate
+# once the Fargate Spot compute environment is full. The normal queue keeps the job_queue_arn of earlier setups.
+job_queues = {
+    'urgent': ('urgent_job_queue_arn', 'job_q_urgent', 100, True),
+    'normal': ('job_queue_arn', 'job_q', 10, False),
+    'bulk': ('bulk_job_queue_arn', 'job_q_bulk', 1, False),
+}
 
 def initialize(**kwargs):
     created_resources = {}
 
     unique_suffix = '_hashcloud_project'
 
-    try:
-        with open('config.json', 'r') as file:
-            config = json.load(file)
-            unique_suffix = config['unique_suffix']    
-    except Exception as e:
+    config = settings.load_config()
+    if not config:
         print("No config file found, using default.")
+    unique_suffix = config.get('unique_suffix', unique_suffix)
     
     try:
         with open('build/resources.json', 'r') as file:
@@ -30,97 +38,132 @@ def initialize(**kwargs):
     except:
         print("No existing resources found, building environment.")
 
-    try:
-        bucket_name = created_resources.get('bucket_name')
-        if not bucket_name:
+    def create_bucket():
+        if not created_resources.get('bucket_name'):
             # Create S3 bucket
-            bucket_name = 'bucket' + unique_suffix
-            bucket_name = creation.create_s3_bucket(bucket_name)
-            created_resources['bucket_name'] = bucket_name
+            created_resources['bucket_name'] = creation.create_s3_bucket('bucket' + unique_suffix)
 
-        role_name = created_resources.get('role_name')
-        role_arn = created_resources.get('role_arn')
-        if not role_name:
+    def create_role():
+        if not created_resources.get('role_name'):
             # Create IAM role
-            role_name = 'iam' + unique_suffix
-            role_name, role_arn = creation.create_iam_role(role_name, bucket_name)
+            role_name, role_arn = creation.create_iam_role('iam' + unique_suffix, 'bucket' + unique_suffix)
             created_resources['role_name'] = role_name
             created_resources['role_arn'] = role_arn
 
-        repository_name = created_resources.get('repository_name')
-        repository_uri = created_resources.get('repository_uri')
-        if not repository_name or not repository_uri:
+    def create_repository():
+        if not created_resources.get('repository_name') or not created_resources.get('repository_uri'):
             # Create ECR repository
-            repository_name = 'ecr_epo' + unique_suffix
-            repository_name, repository_uri = creation.create_ecr_repository(repository_name)
+            repository_name, repository_uri = creation.create_ecr_repository('ecr_epo' + unique_suffix)
             created_resources['repository_name'] = repository_name
             created_resources['repository_uri'] = repository_uri
 
+    def build_image():
         # Build and upload docker to ECR
-        dockerfile_path = 'Docker'
+        dockerfile_path = 'docker'
         aws_region = 'us-east-1'
         image_name = 'docker' + unique_suffix
-        creation.build_and_upload_image(dockerfile_path, repository_name, aws_region, image_name)
+        creation.build_and_upload_image(dockerfile_path, created_resources['repository_name'], aws_region, image_name)
 
-        job_definition_arn = created_resources.get('job_definition_arn')
-        if not job_definition_arn:
+    def create_job_definition():
+        if not created_resources.get('job_definition_arn'):
             # Create Job definition
             job_definition_name = 'batch_job' + unique_suffix
-            container_image = repository_uri + ":latest"
+            container_image = created_resources['repository_uri'] + ":latest"
+            role_arn = created_resources['role_arn']
             command = []
-            job_definition_arn = creation.create_batch_job_definition(job_definition_name, role_arn, role_arn, container_image, command)
-            created_resources['job_definition_arn'] = job_definition_arn
+            created_resources['job_definition_arn'] = creation.create_batch_job_definition(
+                job_definition_name, role_arn, role_arn, container_image, command, config.get('RETRY_ATTEMPTS', 3)
+            )
+
+    default_vpc = {}
 
-        
-        default_vpc = boto3.client('ec2').describe_vpcs(
+    def find_default_vpc():
+        default_vpc.update(clients.client('ec2').describe_vpcs(
             Filters=[
                 {
                     'Name': 'isDefault',
                     'Values': ['true']
                 }
             ]
-        )['Vpcs'][0]
-        default_vpc_id = default_vpc['VpcId']
+        )['Vpcs'][0])
 
-        subnet_id = created_resources.get('subnet_id')
-        if not subnet_id:
+    def create_subnet():
+        if not created_resources.get('subnet_id'):
             # Create a subnet in the default VPC
             vpc_cidr_block = default_vpc['CidrBlock']
             subnet_cidr_block = f'{vpc_cidr_block[:-6]}100.0/24'
-            subnet_id = creation.create_subnet(default_vpc_id, subnet_cidr_block)
-            created_resources['subnet_id'] = subnet_id
+            created_resources['subnet_id'] = creation.create_subnet(default_vpc['VpcId'], subnet_cidr_block)
 
-        security_group_id = created_resources.get('security_group_id')
-        if not security_group_id:
+    def create_security_group():
+        if not created_resources.get('security_group_id'):
             # Create a security group in the default VPC
             group_name = 'sg' + unique_suffix
             description = 'Security Group for ' + unique_suffix
-            security_group_id = creation.create_security_group(group_name, description, default_vpc_id)
-            created_resources['security_group_id'] = security_group_id
+            created_resources['security_group_id'] = creation.create_security_group(group_name, description, default_vpc['VpcId'])
 
-        compute_environment_arn = created_resources.get('compute_environment_arn')
-        if not compute_environment_arn:
+    def create_compute_environment():
+        if not created_resources.get('compute_environment_arn'):
             # Create Compute environment
-            service_role_arn = boto3.client('iam').get_role(RoleName='AWSServiceRoleForBatch')['Role']['Arn']
+            service_role_arn = clients.client('iam').get_role(RoleName='AWSServiceRoleForBatch')['Role']['Arn']
             compute_environment_name = 'compute_env' + unique_suffix
-            subnet_ids = [subnet_id]
-            security_group_ids = [security_group_id]
-            compute_environment_arn = creation.create_batch_compute_environment(compute_environment_name, service_role_arn, subnet_ids, security_group_ids)
-            created_resources['compute_environment_arn'] = compute_environment_arn
-
-        job_queue_arn = created_resources.get('job_queue_arn')
-        if not job_queue_arn:
-            # Create a Job Queue
-            job_queue_name = 'job_q' + unique_suffix
-            compute_environment_order = [
-                {
-                    'order': 1,
-                    'computeEnvironment': compute_environment_arn
-                }
-            ]
-            job_queue_arn = creation.create_batch_job_queue(job_queue_name, compute_environment_order)
-            created_resources['job_queue_arn'] = job_queue_arn
-    
+            subnet_ids = [created_resources['subnet_id']]
+            security_group_ids = [created_resources['security_group_id']]
+            created_resources['compute_environment_arn'] = creation.create_batch_compute_environment(
+                compute_environment_name, service_role_arn, subnet_ids, security_group_ids,
+                max_vcpus=config.get('SPOT_MAX_VCPUS', 256)
+            )
+
+    def create_ondemand_compute_environment():
+        if not created_resources.get('ondemand_compute_environment_arn'):
+            # Create the on-demand Compute environment urgent jobs fall back to
+            service_role_arn = clients.client('iam').get_role(RoleName='AWSServiceRoleForBatch')['Role']['Arn']
+            compute_environment_name = 'compute_env_ondemand' + unique_suffix
+            subnet_ids = [created_resources['subnet_id']]
+            security_group_ids = [created_resources['security_group_id']]
+            created_resources['ondemand_compute_environment_arn'] = creation.create_batch_compute_environment(
+                compute_environment_name, service_role_arn, subnet_ids, security_group_ids,
+                compute_type='FARGATE', max_vcpus=config.get('ONDEMAND_MAX_VCPUS', 64)
+            )
+
+    def create_job_queue(priority):
+        key, name, batch_priority, ondemand = job_queues[priority]
+        def step():
+            if not created_resources.get(key):
+                # Create a Job Queue
+                job_queue_name = name + unique_suffix
+                compute_environment_order = [
+                    {
+                        'order': 1,
+                        'computeEnvironment': created_resources['compute_environment_arn']
+                    }
+                ]
+                if ondemand:
+                    compute_environment_order.append({
+                        'order': 2,
+                        'computeEnvironment': created_resources['ondemand_compute_environment_arn']
+                    })
+                created_resources[key] = creation.create_batch_job_queue(job_queue_name, compute_environment_order, batch_priority)
+        return step
+
+    # Each step only waits for the resources it actually uses
+    steps = {
+        'bucket': ((), create_bucket),
+        'role': ((), create_role),
+        'repository': ((), create_repository),
+        'image': (('repository',), build_image),
+        'job_definition': (('role', 'repository'), create_job_definition),
+        'default_vpc': ((), find_default_vpc),
+        'subnet': (('default_vpc',), create_subnet),
+        'security_group': (('default_vpc',), create_security_group),
+        'compute_environment': (('subnet', 'security_group'), create_compute_environment),
+        'ondemand_compute_environment': (('subnet', 'security_group'), create_ondemand_compute_environment),
+        'job_queue': (('compute_environment',), create_job_queue('normal')),
+        'urgent_job_queue': (('compute_environment', 'ondemand_compute_environment'), create_job_queue('urgent')),
+        'bulk_job_queue': (('compute_environment',), create_job_queue('bulk')),
+    }
+
+    try:
+        provisioning.run_graph(steps)
     except Exception as e:
         print(e)
     finally:
@@ -134,38 +177,45 @@ def cleanup(**kwargs):
     with open('build/resources.json', 'r') as file:
         created_resources = json.load(file)
 
-    bucket_name = created_resources.get('bucket_name')
-    if bucket_name:
-        deletion.delete_s3_bucket(bucket_name)
+    def delete(keys, func):
+        def step():
+            value = created_resources.get(keys[0])
+            if value:
+                func(value)
+            for key in keys:
+                created_resources.pop(key, None)
+        return step
+
+    job_queue_steps = ('job_queue', 'urgent_job_queue', 'bulk_job_queue')
+    compute_environment_steps = ('compute_environment', 'ondemand_compute_environment')
+
+    # Dependencies are reversed: a resource is deleted once nothing that uses it is left
+    steps = {
+        'job_queue': ((), delete(['job_queue_arn'], deletion.delete_batch_job_queue)),
+        'urgent_job_queue': ((), delete(['urgent_job_queue_arn'], deletion.delete_batch_job_queue)),
+        'bulk_job_queue': ((), delete(['bulk_job_queue_arn'], deletion.delete_batch_job_queue)),
+        'job_definition': ((), delete(['job_definition_arn'], deletion.delete_batch_job_definition)),
+        'compute_environment': (job_queue_steps, delete(['compute_environment_arn'], deletion.delete_batch_compute_environment)),
+        'ondemand_compute_environment': (('urgent_job_queue',), delete(['ondemand_compute_environment_arn'], deletion.delete_batch_compute_environment)),
+        'bucket': (job_queue_steps, delete(['bucket_name'], deletion.delete_s3_bucket)),
+        'repository': (job_queue_steps, delete(['repository_name', 'repository_uri'], deletion.delete_ecr_repository)),
+        'role': ((*job_queue_steps, 'job_definition'), delete(['role_name', 'role_arn'], deletion.delete_iam_role)),
+        'subnet': (compute_environment_steps, delete(['subnet_id'], deletion.delete_subnet)),
+        'security_group': (compute_environment_steps, delete(['security_group_id'], deletion.delete_security_group)),
+    }
 
-    role_name = created_resources.get('role_name')
-    if role_name:
-        deletion.delete_iam_role(role_name)
-
-    job_definition_arn = created_resources.get('job_definition_arn')
-    if job_definition_arn:
-        deletion.delete_batch_job_definition(job_definition_arn)
-    
-    job_queue_arn = created_resources.get('job_queue_arn')
-    if job_queue_arn:
-        deletion.delete_batch_job_queue(job_queue_arn)
-    
-    compute_environment_arn = created_resources.get('compute_environment_arn')
-    if compute_environment_arn:
-        deletion.delete_batch_compute_environment(compute_environment_arn)
-
-    subnet_id = created_resources.get('subnet_id')
-    if subnet_id:
-        deletion.delete_subnet(subnet_id)
-
-    security_group_id = created_resources.get('security_group_id')
-    if security_group_id:
-        deletion.delete_security_group(security_group_id)
-
-    repository_name = created_resources.get('repository_name')
-    if repository_name:
-        deletion.delete_ecr_repository(repository_name)
+    try:
+        provisioning.run_graph(steps)
+    except Exception as e:
+        print(e)
+        # Keep what is left so cleanup can be run again
+        with open('build/resources.json', 'w') as file:
+            json.dump(created_resources, file)
+        print("Some resources could not be deleted, run cleanup again to retry.")
+        return
 
     # Remove the resources file
     os.remove('build/resources.json')
-    os.remove('build/jobs.json')
\ No newline at end of file
+    for path in ('build/jobs.db', 'build/jobs.db-wal', 'build/jobs.db-shm'):
+        if os.path.exists(path):
+            os.remove(path)
@@ -5,9 +5,9 @@
 # Date created       : 29 May 2023
 
 import argparse
-from hashcloud.AWS_Resources import resources
-from hashcloud import wordlist
-from hashcloud import crack
+import importlib
+
+from hashcloud import jobstore
 
 def main():
     parser = argparse.ArgumentParser(description='Run hashcat in the cloud.')
@@ -19,11 +19,11 @@ def main():
 
     # Create command
     create_parser = setup_subparsers.add_parser('create', help='Create AWS resources required.')
-    create_parser.set_defaults(func=resources.initialize)
+    create_parser.set_defaults(func='hashcloud.AWS_Resources.resources:initialize')
 
     # Cleanup command
     cleanup_parser = setup_subparsers.add_parser('cleanup', help='Delete AWS resources created.')
-    cleanup_parser.set_defaults(func=resources.cleanup)
+    cleanup_parser.set_defaults(func='hashcloud.AWS_Resources.resources:cleanup')
 
 
     ########### Wordlists subparser ###########
@@ -32,12 +32,25 @@ def main():
 
     # List command
     list_parser = wordlists_subparsers.add_parser('list', help='List all wordlists.')
-    list_parser.set_defaults(func=wordlist.list_wordlists)
+    list_parser.set_defaults(func='hashcloud.wordlist:list_wordlists')
 
     # Upload command
     upload_parser = wordlists_subparsers.add_parser('upload', help='Upload a wordlist.')
     upload_parser.add_argument('-f', type=str, help='Path to the wordlist file.', required=True)
-    upload_parser.set_defaults(func=wordlist.upload_wordlist)
+    upload_parser.add_argument('--part-size', type=int, help='Multipart upload part size in MB.')
+    upload_parser.add_argument('--concurrency', type=int, help='Number of parts uploaded in parallel.')
+    upload_parser.add_argument('--compress', choices=['zstd', 'gzip'], help='Compress the wordlist before uploading it.')
+    upload_parser.add_argument('--chunked', action='store_true', help='Store the wordlist as content-defined chunks, new versions only upload the chunks that changed.')
+    upload_parser.set_defaults(func='hashcloud.wordlist:upload_wordlist')
+
+    # Prepare command
+    prepare_parser = wordlists_subparsers.add_parser('prepare', help='Deduplicate and normalize a wordlist before uploading it.')
+    prepare_parser.add_argument('-f', type=str, help='Path to the wordlist file.', required=True)
+    prepare_parser.add_argument('-o', type=str, help='Path to the prepared wordlist (defaults to <file>.prepared).')
+    prepare_parser.add_argument('--frequency', action='store_true', help='Order candidates by number of occurrences instead of alphabetically.')
+    prepare_parser.add_argument('--workers', type=int, help='Number of processes used (defaults to all cores).')
+    prepare_parser.add_argument('--tmp-dir', type=str, help='Directory for the temporary sort files.')
+    prepare_parser.set_defaults(func='hashcloud.wordlist:prepare_wordlist')
 
 
     ########### Crack subparser ###########
@@ -46,22 +59,41 @@ def main():
 
     # Initiate command
     initiate_parser = crack_subparsers.add_parser('initiate', help='Initiate a new cracking job.')
-    initiate_parser.add_argument('-f', type=str, help='Path to the file to crack.', required=True)
-    initiate_parser.add_argument('-w', type=str, help='Name of the wordlist to use for cracking.', required=True)
-    initiate_parser.add_argument('--options', type=str, help='Specify additional hashcat options for cracking.', required=True)
-    initiate_parser.set_defaults(func=crack.crack_hashes)
+    initiate_parser.add_argument('-f', type=str, help='Path to the file to crack, or a directory or glob pattern of files cracked together.', required=True)
+    initiate_parser.add_argument('-w', type=str, help='Name of the wordlist to use for cracking, for -a 0, 6 and 7.')
+    initiate_parser.add_argument('--mask', type=str, help='Mask to crack with, for -a 3, 6 and 7. Custom charsets -1 to -4 are read from --options.')
+    initiate_parser.add_argument('--options', type=str, help='Specify additional hashcat options for cracking. Without -m, the mode of each hash is detected and mixed files are split into one job per mode.', required=True)
+    initiate_parser.add_argument('--shards', type=int, default=1, help='Split the wordlist, or the keyspace of mask attacks, into N shards cracked in parallel as an array job.')
+    initiate_parser.add_argument('--auto-size', action='store_true', help='Pick the vCPU and memory of the job, and the number of slices of mask attacks, from the hashes, wordlist and past runtimes.')
+    initiate_parser.add_argument('--dry-run', action='store_true', help='Print the estimated runtime and cost without submitting the job.')
+    initiate_parser.add_argument('--backend', choices=['batch', 'local', 'auto'], help='Where to run the job, auto runs small jobs locally. Defaults to BACKEND in config.json, or batch.')
+    initiate_parser.add_argument('--priority', choices=['urgent', 'normal', 'bulk'], default='normal', help='Job queue to submit to, urgent jobs fall back to on-demand Fargate when Fargate Spot is full.')
+    initiate_parser.add_argument('--share', type=str, help='Fair share the job counts against when capacity is scarce, such as an engagement name. Defaults to SHARE in config.json.')
+    initiate_parser.set_defaults(func='hashcloud.crack:crack_hashes')
 
     # Satus command 
     status_parser = crack_subparsers.add_parser('status', help='Check cracking job status.')
-    status_parser.set_defaults(func=crack.crack_jobs_status)
+    status_parser.add_argument('--filter', type=str.upper, nargs='+', choices=jobstore.statuses, help='Only show jobs in these states.')
+    status_parser.add_argument('--since', type=str, help='Only show jobs submitted since a duration (30m, 2h, 7d) or an ISO date.')
+    status_parser.set_defaults(func='hashcloud.crack:crack_jobs_status')
+
+    # Watch command
+    watch_parser = crack_subparsers.add_parser('watch', help='Wait for running jobs and print results as they complete.')
+    watch_parser.add_argument('--interval', type=int, default=5, help='Initial polling interval in seconds.')
+    watch_parser.add_argument('--max-interval', type=int, default=120, help='Maximum polling interval in seconds.')
+    watch_parser.set_defaults(func='hashcloud.crack:watch_jobs')
 
     # Result command
     result_parser = crack_subparsers.add_parser('result', help='Get the result from a completed cracking job.')
-    result_parser.add_argument('-f', type=str, help='File to get the results for.', required=True)
-    result_parser.set_defaults(func=crack.get_results)
+    result_parser.add_argument('-f', type=str, help='File to get the results for, glob patterns are matched against submitted files.')
+    result_parser.add_argument('--all', action='store_true', help='Get the results of every submitted file.')
+    result_parser.set_defaults(func='hashcloud.crack:get_results')
 
+    # Subcommand modules, and boto3 with them, are only imported once the command is known
     args = parser.parse_args()
-    args.func(**vars(args))
+    module_name, func_name = args.func.split(':')
+    func = getattr(importlib.import_module(module_name), func_name)
+    func(**vars(args))
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
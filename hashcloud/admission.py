@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# File name          : admission.py
+# Author             : TomPh
+# Date created       : 29 May 2023
+
+"""
+Client-side admission of Batch jobs. A job is submitted while the vCPUs of the jobs in flight leave room
+for it in the compute environments its queue can use, otherwise it is held in the job store and submitted
+by a later crack command once capacity frees up. Held jobs are admitted by priority, then by fair share:
+the share with the fewest vCPUs in flight goes first.
+"""
+
+from hashcloud import backends
+from hashcloud import jobstore
+from hashcloud import settings
+
+priorities = ('urgent', 'normal', 'bulk')
+default_priority = 'normal'
+default_share = 'default'
+
+def capacity(priority, config):
+    """vCPUs the queue of a priority can run on: Fargate Spot, plus on-demand Fargate for urgent jobs."""
+    vcpus = config.get('SPOT_MAX_VCPUS', 256)
+    if priority == 'urgent':
+        vcpus += config.get('ONDEMAND_MAX_VCPUS', 64)
+    return vcpus
+
+def job_vcpus(job):
+    """vCPUs a job holds until it finishes, one task per shard that has not finished yet."""
+    summary = job['details'].get('arrayProperties', {}).get('statusSummary', {})
+    tasks = (job['shards'] or 1) - summary.get('SUCCEEDED', 0) - summary.get('FAILED', 0)
+    return (job['vcpu'] or 0) * max(tasks, 0)
+
+def admit(config=None):
+    """Submit the held jobs that fit, returns their job IDs keyed by the IDs they were held under."""
+    config = config or settings.load_config()
+    jobstore.release_stale_claims()
+    jobs = [j for j in jobstore.get_jobs(live=True) if (j['backend'] or backends.default_backend) == 'batch']
+    held = [j for j in jobs if j['status'] == 'HELD']
+    if not held:
+        return {}
+
+    usage = {}
+    for j in jobs:
+        if j['status'] != 'HELD':
+            share = j['share'] or default_share
+            usage[share] = usage.get(share, 0) + job_vcpus(j)
+    in_flight = sum(usage.values())
+
+    def rank(j):
+        return (priorities.index(j['priority'] or default_priority), usage.get(j['share'] or default_share, 0), j['submitted'] or 0)
+
+    admitted = {}
+    while held:
+        j = min(held, key=rank)
+        priority = j['priority'] or default_priority
+        vcpus = job_vcpus(j)
+        # Later jobs wait behind the first one that does not fit, so large jobs are not starved.
+        # A job larger than the whole capacity is admitted alone, Batch starts its tasks as room frees up.
+        if in_flight and in_flight + vcpus > capacity(priority, config):
+            break
+        held.remove(j)
+        if not jobstore.claim_held_job(j['id']):
+            continue
+        spec = j['spec']
+        try:
+            job_id = backends.get_backend('batch').submit(
+                spec['job_name'], spec['command'], spec['environment'], spec['vcpu'], spec['memory'],
+                spec['array_size'], config, priority
+            )
+        except BaseException:
+            # Interrupted submissions are held again too, a job left claimed would never be admitted
+            jobstore.release_held_job(j['id'])
+            raise
+        jobstore.admit_job(j['id'], job_id)
+        admitted[j['id']] = job_id
+
+        share = j['share'] or default_share
+        usage[share] = usage.get(share, 0) + vcpus
+        in_flight += vcpus
+    return admitted
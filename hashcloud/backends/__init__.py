@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# File name          : __init__.py
+# Author             : TomPh
+# Date created       : 29 May 2023
+
+"""
+Backends run crack jobs. Each backend module provides:
+- submit(job_name, command, environment, vcpu, memory, array_size, config, priority), returning the job ID,
+- describe(job_ids), returning describe_jobs-like records keyed by job ID.
+"""
+
+import importlib
+import os
+
+from hashcloud import settings
+from hashcloud import sizing
+
+names = ('batch', 'local')
+default_backend = 'batch'
+
+def get_backend(name):
+    return importlib.import_module(f"hashcloud.backends.{name}")
+
+def choose_backend(mode, candidates, salts, wordlist_size):
+    """Send jobs this machine cracks within LOCAL_MAX_SECONDS to the local backend, the others to Batch."""
+    config = settings.load_config()
+    seconds = sizing.estimate_seconds(mode, candidates, salts, wordlist_size, os.cpu_count() or 1) - sizing.startup_seconds
+    return 'local' if seconds <= config.get('LOCAL_MAX_SECONDS', 60) else 'batch'
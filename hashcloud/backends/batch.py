@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# File name          : batch.py
+# Author             : TomPh
+# Date created       : 29 May 2023
+
+from concurrent.futures import ThreadPoolExecutor
+
+from hashcloud import clients
+from hashcloud import settings
+
+# describe_jobs accepts at most 100 job IDs per call.
+describe_jobs_limit = 100
+status_workers = 8
+
+# Job queue of each priority, set up by resources.initialize
+job_queue_keys = {
+    'urgent': 'urgent_job_queue_arn',
+    'normal': 'job_queue_arn',
+    'bulk': 'bulk_job_queue_arn',
+}
+
+def retry_strategy(attempts):
+    """Retry jobs whose Fargate Spot task was reclaimed, fail on any other error."""
+    return {
+        'attempts': attempts,
+        'evaluateOnExit': [
+            {'onStatusReason': 'Your Spot Task was interrupted*', 'action': 'RETRY'},
+            {'onStatusReason': 'Host EC2*', 'action': 'RETRY'},
+            {'onReason': '*', 'action': 'EXIT'},
+        ]
+    }
+
+def submit(job_name, command, environment, vcpu, memory, array_size, config, priority='normal'):
+    """
+    Submit the job to the AWS Batch queue of its priority, as an array job when array_size is over 1.
+    Setups made before the priority queues existed only have the normal queue, which then takes every job.
+    """
+    created_resources = settings.load_resources()
+    batch = clients.client('batch')
+
+    container_overrides = {
+        'command': command,
+        'resourceRequirements': [
+            {
+                'value': f"{vcpu}",
+                'type': 'VCPU'
+            },
+            {
+                'value': f"{memory}",
+                'type': 'MEMORY'
+            },
+        ],
+        'environment': environment,
+    }
+    submit_args = {
+        'retryStrategy': retry_strategy(config.get('RETRY_ATTEMPTS', 3))
+    }
+    if array_size > 1:
+        submit_args['arrayProperties'] = {'size': array_size}
+
+    response = batch.submit_job(
+        jobName=job_name,
+        jobQueue=created_resources.get(job_queue_keys[priority]) or created_resources.get('job_queue_arn'),
+        jobDefinition=created_resources.get('job_definition_arn'),
+        containerOverrides=container_overrides,
+        **submit_args
+    )
+    return response['jobId']
+
+def describe(job_ids):
+    """Describe jobs in API-sized chunks fetched concurrently, returns a dict keyed by job ID."""
+    batch = clients.client('batch')
+    chunks = [job_ids[i:i + describe_jobs_limit] for i in range(0, len(job_ids), describe_jobs_limit)]
+    with ThreadPoolExecutor(max_workers=status_workers) as executor:
+        responses = executor.map(lambda chunk: batch.describe_jobs(jobs=chunk)['jobs'], chunks)
+    job_statuses = {}
+    for response in responses:
+        for js in response:
+            job_statuses[js['jobId']] = {
+                key: js[key]
+                for key in ('jobId', 'status', 'createdAt', 'startedAt', 'stoppedAt', 'arrayProperties')
+                if key in js
+            }
+    return job_statuses
+
+def child_runtimes(job_id):
+    """Return the runtimes in seconds of the succeeded children of an array job."""
+    batch = clients.client('batch')
+    runtimes = []
+    for page in batch.get_paginator('list_jobs').paginate(arrayJobId=job_id, jobStatus='SUCCEEDED'):
+        for js in page['jobSummaryList']:
+            if js.get('startedAt') and js.get('stoppedAt'):
+                runtimes.append((js['stoppedAt'] - js['startedAt']) / 1000)
+    return runtimes
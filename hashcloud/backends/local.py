@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# File name          : local.py
+# Author             : TomPh
+# Date created       : 29 May 2023
+
+"""
+Run jobs on this machine. Each job is a detached worker process that waits for one of LOCAL_CONCURRENCY
+slots, then runs the container entrypoint with local hashcat, or the job image with LOCAL_RUNNER set to docker.
+Jobs read their inputs from and write their results to S3 like Batch jobs do.
+"""
+
+import fcntl
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+import uuid
+
+from hashcloud import settings
+
+local_folder = 'build/local'
+root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+runner_path = os.path.join(root, 'docker', 'run.py')
+terminal_statuses = ('SUCCEEDED', 'FAILED')
+
+# Credentials and settings passed on to the job container.
+aws_variables = ('AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY', 'AWS_SESSION_TOKEN', 'AWS_DEFAULT_REGION', 'AWS_REGION', 'AWS_PROFILE', 'AWS_ENDPOINT_URL')
+
+def _now():
+    return int(time.time() * 1000)
+
+def _state_path(job_id):
+    return os.path.join(local_folder, f"{job_id}.json")
+
+def _load(job_id):
+    try:
+        with open(_state_path(job_id), 'r') as file:
+            return json.load(file)
+    except:
+        return None
+
+def _pid_path(job_id):
+    return os.path.join(local_folder, f"{job_id}.pid")
+
+def _worker_pid(state):
+    """pid of the worker of a job, recorded at submission as the worker can die before recording it."""
+    try:
+        with open(_pid_path(state['jobId']), 'r') as file:
+            return int(file.read())
+    except (OSError, ValueError):
+        return state.get('pid')
+
+def _save(state):
+    tmp_path = f"{_state_path(state['jobId'])}.tmp"
+    with open(tmp_path, 'w') as file:
+        json.dump(state, file)
+    os.replace(tmp_path, _state_path(state['jobId']))
+
+def _alive(pid):
+    # Workers started by this process stay zombies until they are reaped
+    try:
+        if os.waitpid(pid, os.WNOHANG)[0] == pid:
+            return False
+    except ChildProcessError:
+        pass
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def submit(job_name, command, environment, vcpu, memory, array_size, config, priority='normal'):
+    """Start a detached worker for the job, array jobs are not supported and run as a single task, priorities are ignored."""
+    os.makedirs(local_folder, exist_ok=True)
+    job_id = f"local-{uuid.uuid4()}"
+    _save({
+        'jobId': job_id,
+        'jobName': job_name,
+        'status': 'RUNNABLE',
+        'createdAt': _now(),
+        'command': command,
+        'environment': {variable['name']: variable['value'] for variable in environment},
+    })
+    with open(os.path.join(local_folder, f"{job_id}.log"), 'wb') as log:
+        worker = subprocess.Popen(
+            [sys.executable, '-m', 'hashcloud.backends.local', job_id],
+            stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT,
+            env={**os.environ, 'PYTHONPATH': os.pathsep.join(filter(None, [root, os.environ.get('PYTHONPATH')]))},
+            start_new_session=True
+        )
+    # Written next to the state, which the worker updates from now on
+    with open(_pid_path(job_id), 'w') as file:
+        file.write(str(worker.pid))
+    return job_id
+
+def describe(job_ids):
+    """Return the state of local jobs, jobs whose worker died before finishing are reported as failed."""
+    job_statuses = {}
+    for job_id in job_ids:
+        state = _load(job_id)
+        if state is None:
+            continue
+        pid = _worker_pid(state)
+        if state['status'] not in terminal_statuses and pid and not _alive(pid):
+            state.update(status='FAILED', stoppedAt=_now(), statusReason='Worker process exited')
+            _save(state)
+        job_statuses[job_id] = {
+            key: state[key]
+            for key in ('jobId', 'status', 'createdAt', 'startedAt', 'stoppedAt')
+            if key in state
+        }
+    return job_statuses
+
+def _acquire_slot(concurrency):
+    """Wait for one of the concurrency slots, returns the file holding its lock."""
+    while True:
+        for i in range(concurrency):
+            slot = open(os.path.join(local_folder, f"slot{i}.lock"), 'w')
+            try:
+                fcntl.flock(slot, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return slot
+            except BlockingIOError:
+                slot.close()
+        time.sleep(1)
+
+def _local_command(command, environment, config):
+    # Batch jobs run "python3 /tmp/run.py <args>" in the container
+    args = command[2:]
+    if config.get('LOCAL_RUNNER', 'python') == 'docker':
+        image = f"{settings.load_resources()['repository_uri']}:latest"
+        variables = [name for name in (*environment, *aws_variables) if name in environment or name in os.environ]
+        return [
+            'docker', 'run', '--rm',
+            '-v', f"{os.path.expanduser('~/.aws')}:/home/hashcat/.aws:ro",
+            *[option for name in variables for option in ('-e', name)],
+            image, *command
+        ]
+    return [sys.executable, runner_path, *args]
+
+def run(job_id):
+    """Worker process of a job: wait for a slot, run the job and record how it ended."""
+    config = settings.load_config()
+    state = _load(job_id)
+    state['pid'] = os.getpid()
+    _save(state)
+
+    slot = _acquire_slot(config.get('LOCAL_CONCURRENCY', 2))
+    work_dir = os.path.abspath(os.path.join(local_folder, job_id))
+    os.makedirs(work_dir, exist_ok=True)
+    state.update(status='RUNNING', startedAt=_now())
+    _save(state)
+
+    environment = {
+        **state['environment'],
+        'AWS_BATCH_JOB_ID': job_id,
+        'HASHCAT_SESSION': job_id,
+    }
+    if config.get('LOCAL_RUNNER', 'python') != 'docker':
+        environment['WORK_DIR'] = work_dir
+    try:
+        returncode = subprocess.call(_local_command(state['command'], environment, config), env={**os.environ, **environment})
+    except Exception as e:
+        print(f"Job '{job_id}' could not be started: {e}")
+        returncode = -1
+
+    state.update(status='SUCCEEDED' if returncode == 0 else 'FAILED', stoppedAt=_now(), exitCode=returncode)
+    _save(state)
+    shutil.rmtree(work_dir, ignore_errors=True)
+    slot.close()
+
+if __name__ == '__main__':
+    run(sys.argv[1])
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# File name          : catalog.py
+# Author             : TomPh
+# Date created       : 29 May 2023
+
+import hashlib
+import json
+import os
+from collections import Counter
+from botocore.exceptions import ClientError
+
+from hashcloud import clients
+
+s3 = clients.LazyClient('s3')
+
+wordlist_folder = 'passlists'
+manifest_key = 'manifest.json'
+local_manifest_path = 'build/manifest.json'
+
+# Candidates longer than this are counted in the last histogram bucket.
+max_histogram_length = 64
+
+def scan_wordlist(path, block_size=8 * 1024 * 1024):
+    """Compute the size, line count, SHA-256 and candidate length histogram of a file in one pass."""
+    digest = hashlib.sha256()
+    histogram = Counter()
+    size = 0
+    remainder = b''
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            digest.update(block)
+            size += len(block)
+            lines = (remainder + block).split(b'\n')
+            remainder = lines.pop()
+            histogram.update(min(len(line.rstrip(b'\r')), max_histogram_length) for line in lines)
+    if remainder:
+        histogram[min(len(remainder.rstrip(b'\r')), max_histogram_length)] += 1
+    return {
+        'size': size,
+        'lines': sum(histogram.values()),
+        'sha256': digest.hexdigest(),
+        'histogram': {str(length): count for length, count in sorted(histogram.items())},
+    }
+
+def _load_local_manifest():
+    try:
+        with open(local_manifest_path, 'r') as file:
+            return json.load(file)
+    except:
+        return None
+
+def _save_local_manifest(etag, wordlists):
+    os.makedirs(os.path.dirname(local_manifest_path), exist_ok=True)
+    with open(local_manifest_path, 'w') as file:
+        json.dump({'etag': etag, 'wordlists': wordlists}, file)
+
+def load_manifest(bucket_name):
+    """
+    Return (etag, wordlists) for the manifest in the bucket, revalidating the local copy with a conditional GET.
+    Returns (None, None) when the bucket has no manifest yet.
+    """
+    local = _load_local_manifest()
+    request = {'Bucket': bucket_name, 'Key': manifest_key}
+    if local:
+        request['IfNoneMatch'] = local['etag']
+    try:
+        response = s3.get_object(**request)
+    except ClientError as e:
+        code = e.response['Error']['Code']
+        if code in ('304', 'NotModified'):
+            return local['etag'], local['wordlists']
+        if code in ('NoSuchKey', '404'):
+            return None, None
+        raise
+    wordlists = json.loads(response['Body'].read())
+    _save_local_manifest(response['ETag'], wordlists)
+    return response['ETag'], wordlists
+
+def update_manifest(bucket_name, name, entry, retries=10):
+    """Add or replace a wordlist entry, retrying when another client updated the manifest concurrently."""
+    for _ in range(retries):
+        etag, wordlists = load_manifest(bucket_name)
+        # The first manifest lists the wordlists uploaded before it existed too
+        wordlists = dict(wordlists if wordlists is not None else list_wordlist_entries(bucket_name))
+        wordlists[name] = entry
+        body = json.dumps(wordlists).encode()
+        # Only write over the version that was read, or create the manifest if there was none
+        condition = {'IfMatch': etag} if etag else {'IfNoneMatch': '*'}
+        try:
+            response = s3.put_object(Bucket=bucket_name, Key=manifest_key, Body=body, **condition)
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('PreconditionFailed', 'ConditionalRequestConflict', '412', '409'):
+                continue
+            raise
+        _save_local_manifest(response['ETag'], wordlists)
+        return
+    raise RuntimeError("Could not update the wordlist manifest, too many concurrent updates.")
+
+def list_wordlist_keys(bucket_name):
+    """List every wordlist object in the bucket, following pagination. Chunks and version manifests are skipped."""
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=f"{wordlist_folder}/", Delimiter='/'):
+        for obj in page.get('Contents', []):
+            yield obj
+
+def list_wordlist_entries(bucket_name):
+    """Return entries keyed by name for the wordlist objects in the bucket, with only their size and ETag."""
+    return {obj['Key'].split('/')[-1]: {'size': obj['Size'], 'etag': obj['ETag']} for obj in list_wordlist_keys(bucket_name)}
+
+def get_wordlists(bucket_name):
+    """Return wordlist entries keyed by name, from the manifest or from a listing for buckets without one."""
+    _, wordlists = load_manifest(bucket_name)
+    if wordlists is not None:
+        return wordlists
+    return list_wordlist_entries(bucket_name)
+
+def get_wordlist(bucket_name, name):
+    """Return the manifest entry of a wordlist, or None if it is not in the bucket."""
+    _, wordlists = load_manifest(bucket_name)
+    if wordlists is not None and name in wordlists:
+        return wordlists[name]
+    # Wordlists uploaded before the manifest existed
+    try:
+        response = s3.head_object(Bucket=bucket_name, Key=f"{wordlist_folder}/{name}")
+    except ClientError:
+        return None
+    return {'size': response['ContentLength'], 'etag': response['ETag']}
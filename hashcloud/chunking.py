@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# File name          : chunking.py
+# Author             : TomPh
+# Date created       : 29 May 2023
+
+"""
+Chunked wordlist storage. A wordlist is cut into line-aligned chunks whose boundaries depend only on the
+lines around them, so appending or inserting lines leaves the other chunks unchanged. Chunks are stored
+once under their SHA-256, and each uploaded version of a wordlist gets a manifest listing its chunks in order.
+Uploading a new version, or a variant of a list, only sends the chunks the bucket does not have yet.
+"""
+
+import hashlib
+import json
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from hashcloud import clients
+from hashcloud import compression
+from hashcloud import prepare
+
+s3 = clients.LazyClient('s3')
+
+chunk_folder = 'passlists/chunks'
+version_folder = 'passlists/versions'
+
+# Uncompressed chunk sizes: the average the boundaries are drawn for, and the bounds they are kept within.
+average_chunk_size = 4 * 1024 * 1024
+min_chunk_size = 1024 * 1024
+max_chunk_size = 16 * 1024 * 1024
+# A line ends a chunk when its CRC-32 falls below this threshold per byte of the line,
+# which draws a boundary every average_chunk_size bytes on average.
+boundary_threshold = 2 ** 32 // average_chunk_size
+
+def _candidate_boundaries(path, start, end):
+    """Offsets right after the lines of a block that can end a chunk."""
+    with open(path, 'rb') as file:
+        file.seek(start)
+        data = file.read(end - start)
+    lines = data.split(b'\n')
+    if not lines[-1]:
+        lines.pop()
+    offsets = []
+    offset = start
+    for line in lines:
+        offset += len(line) + 1
+        if zlib.crc32(line) < (len(line) + 1) * boundary_threshold:
+            offsets.append(min(offset, end))
+    return offsets
+
+def _line_end_before(path, start, limit):
+    """
+    Offset right after the last line break in [start, limit), or limit when no line ends there: such a line
+    is split between two chunks, which only matters to shards that start on it.
+    """
+    with open(path, 'rb') as file:
+        file.seek(start)
+        newline = file.read(limit - start).rfind(b'\n')
+    return start + newline + 1 if newline != -1 else limit
+
+def chunk_boundaries(path, workers=None):
+    """Return the (start, end) offsets of the chunks of a file, candidate lines are found on every core."""
+    size = os.path.getsize(path)
+    blocks = prepare.line_chunks(path, size)
+    workers = min(workers or os.cpu_count() or 1, len(blocks))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            candidates = list(executor.map(_candidate_boundaries, *zip(*[(path, start, end) for start, end in blocks])))
+    else:
+        candidates = [_candidate_boundaries(path, start, end) for start, end in blocks]
+
+    cuts = [0]
+    for offset in [offset for block in candidates for offset in block] + [size]:
+        while offset - cuts[-1] > max_chunk_size:
+            cuts.append(_line_end_before(path, cuts[-1] + min_chunk_size, cuts[-1] + max_chunk_size))
+        if offset - cuts[-1] >= min_chunk_size or (offset == size and offset > cuts[-1]):
+            cuts.append(offset)
+    return list(zip(cuts[:-1], cuts[1:]))
+
+def list_chunks(bucket_name):
+    """Return the keys of the chunks already in the bucket."""
+    keys = set()
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=f"{chunk_folder}/"):
+        keys.update(obj['Key'] for obj in page.get('Contents', []))
+    return keys
+
+def upload_chunked(path, bucket_name, name, entry, codec=None, concurrency=8):
+    """
+    Upload the chunks of a wordlist the bucket does not have yet, compressed with codec if given, then the
+    manifest of this version. Returns the version manifest key, the number of chunks, the number of them
+    that were sent and the bytes sent.
+    """
+    boundaries = chunk_boundaries(path)
+    existing = list_chunks(bucket_name)
+    extension = compression.extensions[codec] if codec else ''
+
+    def store(boundary):
+        start, end = boundary
+        with open(path, 'rb') as file:
+            file.seek(start)
+            data = file.read(end - start)
+        key = f"{chunk_folder}/{hashlib.sha256(data).hexdigest()}{extension}"
+        sent = 0
+        if key not in existing:
+            body = compression.compress_data(data, codec) if codec else data
+            s3.put_object(Bucket=bucket_name, Key=key, Body=body)
+            sent = len(body)
+        return {'key': key, 'size': end - start}, sent
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(store, boundaries))
+
+    version_key = f"{version_folder}/{name}/{entry['sha256'][:16]}.json"
+    chunks = [chunk for chunk, _ in results]
+    s3.put_object(Bucket=bucket_name, Key=version_key, Body=json.dumps({
+        'name': name,
+        'sha256': entry['sha256'],
+        'size': entry['size'],
+        'lines': entry['lines'],
+        'codec': codec,
+        'chunks': chunks,
+    }).encode())
+    return version_key, len(chunks), sum(1 for _, sent in results if sent), sum(sent for _, sent in results)
+
+def load_version(bucket_name, version_key):
+    """Return the manifest of a wordlist version."""
+    return json.loads(s3.get_object(Bucket=bucket_name, Key=version_key)['Body'].read())
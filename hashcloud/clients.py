@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# File name          : clients.py
+# Author             : TomPh
+# Date created       : 29 May 2023
+
+import threading
+
+# Large enough for the thread pools used by transfers, status and result retrieval.
+max_pool_connections = 64
+retries = {'max_attempts': 10, 'mode': 'adaptive'}
+
+_lock = threading.Lock()
+_session = None
+_clients = {}
+
+def session():
+    """Return the shared boto3 session, importing boto3 on first use only."""
+    global _session
+    with _lock:
+        if _session is None:
+            import boto3
+            _session = boto3.session.Session()
+        return _session
+
+def client(service_name, **kwargs):
+    """Return a shared client for a service, created once with pooled connections and adaptive retries."""
+    key = (service_name, tuple(sorted(kwargs.items())))
+    if key in _clients:
+        return _clients[key]
+    shared_session = session()
+    # Sessions are not thread safe, clients are
+    with _lock:
+        if key not in _clients:
+            from botocore.config import Config
+            config = Config(max_pool_connections=max_pool_connections, retries=retries)
+            _clients[key] = shared_session.client(service_name, config=config, **kwargs)
+        return _clients[key]
+
+def resource(service_name, **kwargs):
+    shared_session = session()
+    with _lock:
+        return shared_session.resource(service_name, **kwargs)
+
+class LazyClient:
+    """Stand-in for a client that is only created the first time it is used."""
+
+    def __init__(self, service_name, **kwargs):
+        self._service_name = service_name
+        self._kwargs = kwargs
+
+    def __getattr__(self, name):
+        return getattr(client(self._service_name, **self._kwargs), name)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# File name          : compression.py
+# Author             : TomPh
+# Date created       : 29 May 2023
+
+import gzip
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+extensions = {
+    'zstd': '.zst',
+    'gzip': '.gz',
+}
+
+# Uncompressed size of each independently compressed frame.
+frame_size = 16 * 1024 * 1024
+
+def codec_for(file_name):
+    """Return the codec of a compressed wordlist based on its extension, or None."""
+    for codec, extension in extensions.items():
+        if file_name.endswith(extension):
+            return codec
+    return None
+
+def _compress_frame(codec, data, level):
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+def compress_data(data, codec, level=None):
+    """Compress data as a single frame, which decompresses on its own or concatenated with others."""
+    if codec == 'zstd' and zstandard is None:
+        raise ImportError("The zstandard package is required for zstd compression.")
+    if level is None:
+        level = 3 if codec == 'zstd' else 6
+    return _compress_frame(codec, data, level)
+
+def _read_frames(file, size):
+    # Frames always end on a line break so each one can be cracked on its own.
+    while True:
+        data = file.read(size)
+        if not data:
+            return
+        if not data.endswith(b'\n'):
+            data += file.readline()
+        yield data
+
+def compress_file(path, out_path, codec, level=None, frame_size=frame_size, workers=4):
+    """
+    Compress a wordlist as a sequence of independent, line-aligned frames.
+    The concatenated frames decompress as a single stream with the standard zstd/gzip tools.
+    Returns the frame index as a list of [compressed offset, compressed size, uncompressed offset, uncompressed size].
+    """
+    if codec not in extensions:
+        raise ValueError(f"Unsupported compression '{codec}'.")
+    if codec == 'zstd' and zstandard is None:
+        raise ImportError("The zstandard package is required for zstd compression.")
+    if level is None:
+        level = 3 if codec == 'zstd' else 6
+
+    frames = []
+    compressed_offset = 0
+    uncompressed_offset = 0
+    with open(path, 'rb') as src, open(out_path, 'wb') as dst, ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = []
+
+        def flush(future, length):
+            nonlocal compressed_offset, uncompressed_offset
+            compressed = future.result()
+            dst.write(compressed)
+            frames.append([compressed_offset, len(compressed), uncompressed_offset, length])
+            compressed_offset += len(compressed)
+            uncompressed_offset += length
+
+        for data in _read_frames(src, frame_size):
+            pending.append((executor.submit(_compress_frame, codec, data, level), len(data)))
+            # Bound the number of frames held in memory while keeping them in order.
+            if len(pending) >= workers * 2:
+                flush(*pending.pop(0))
+        for future, length in pending:
+            flush(future, length)
+
+    return frames
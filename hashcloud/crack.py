@@ -4,166 +4,747 @@
 # Author             : TomPh
 # Date created       : 29 May 2023
 
-import boto3
 import json
+import os
+import random
+import re
+import shutil
+import sys
+import time
+from botocore.exceptions import ClientError
 from tabulate import tabulate
 import datetime
+import glob
+import hashlib
+import tempfile
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
-s3 = boto3.client('s3')
+from hashcloud import admission
+from hashcloud import backends
+from hashcloud import catalog
+from hashcloud import chunking
+from hashcloud import clients
+from hashcloud import compression
+from hashcloud import ingest
+from hashcloud import jobstore
+from hashcloud import keyspace
+from hashcloud import potfile
+from hashcloud import settings
+from hashcloud import sizing
+
+s3 = clients.LazyClient('s3')
 
 wordlist_folder = 'passlists'
+index_folder = 'indexes'
 to_crack_folder = 'to_crack'
+shards_folder = 'shards'
+# Inputs of each supported attack mode, in the order hashcat takes them after the hash file.
+attack_inputs = {
+    0: ('wordlist',),
+    3: ('mask',),
+    6: ('wordlist', 'mask'),
+    7: ('mask', 'wordlist'),
+}
+# Attacks split into --skip/--limit slices of their keyspace, the others are split by wordlist byte ranges.
+keyspace_attacks = (3, 7)
+# Concurrent uploads of the hash files packed into a job.
+upload_workers = 8
+
+# Size of the ranged GET used to find the next line break after a shard offset.
+shard_probe_size = 64 * 1024
+# AWS Batch array jobs are limited to 10,000 children.
+max_shards = 10000
+
+terminal_statuses = jobstore.terminal_statuses
+# Jobs the backend no longer describes after this many milliseconds, past the retention of Batch or whose
+# local state is gone, are marked UNKNOWN. Newer jobs may not be visible to the API yet.
+missing_job_delay = 5 * 60 * 1000
+throttling_errors = ('TooManyRequestsException', 'ThrottlingException')
+
+results_folder = 'cracked'
+result_workers = 16
+# Containers write the last hashcat status of each job child to progress/<job ID>/<index>.json.
+progress_folder = 'progress'
+
+created_resources = settings.load_resources()
+bucket_name = created_resources.get('bucket_name')
+job_definition_arn = created_resources.get('job_definition_arn')
+job_queue_arn = created_resources.get('job_queue_arn')
+
+def get_frame_shards(frames, shards):
+    """Group the frames of a compressed wordlist into shards of similar uncompressed size."""
+    # An empty wordlist has no frames and nothing to split
+    if not frames:
+        return []
+    total = sum(frame[3] for frame in frames)
+    ranges = []
+    start = 0
+    uncompressed = 0
+    for frame in frames:
+        uncompressed += frame[3]
+        end = frame[0] + frame[1]
+        if uncompressed * shards >= total * (len(ranges) + 1):
+            ranges.append((start, end - 1))
+            start = end
+    if start < frames[-1][0] + frames[-1][1]:
+        ranges.append((start, frames[-1][0] + frames[-1][1] - 1))
+    return ranges
+
+def get_wordlist_shards(file_name, entry, shards):
+    """Split a wordlist stored on S3, described by its manifest entry, into line-aligned inclusive byte ranges."""
+    wordlist_key = f"{wordlist_folder}/{file_name}"
+    shards = min(shards, entry.get('lines', shards))
+    if entry.get('chunks'):
+        # Chunked wordlists are split on chunk boundaries, their shards are ranges of chunk indexes
+        chunks = chunking.load_version(bucket_name, entry['chunks'])['chunks']
+        return get_frame_shards([(i, 1, None, chunk['size']) for i, chunk in enumerate(chunks)], shards)
+    if compression.codec_for(file_name):
+        # Compressed wordlists can only be split on frame boundaries
+        response = s3.get_object(Bucket=bucket_name, Key=f"{index_folder}/{file_name}.json")
+        return get_frame_shards(json.loads(response['Body'].read())['frames'], shards)
+
+    size = entry['size']
+    boundaries = [0]
+    for i in range(1, shards):
+        offset = size * i // shards
+        if offset <= boundaries[-1]:
+            continue
+        # Probe from the byte before the offset so a shard can start right after a line break.
+        response = s3.get_object(
+            Bucket=bucket_name,
+            Key=wordlist_key,
+            Range=f"bytes={offset - 1}-{offset - 1 + shard_probe_size - 1}"
+        )
+        newline = response['Body'].read().find(b'\n')
+        if newline == -1:
+            # Line longer than the probe, leave it to the previous shard.
+            continue
+        boundary = offset + newline
+        if boundary >= size:
+            break
+        if boundary > boundaries[-1]:
+            boundaries.append(boundary)
+    boundaries.append(size)
+    return [(boundaries[i], boundaries[i + 1] - 1) for i in range(len(boundaries) - 1)]
+
+def checkpoint_id(hashes, wordlist, options, ranges, version=None):
+    """
+    Identify a crack by its inputs, so a retried or resubmitted job with the same hashes,
+    wordlist, options and shards resumes from the checkpoints of the previous attempt.
+    version identifies the content of the wordlist, a wordlist replaced under the same name starts over.
+    """
+    digest = hashlib.sha256()
+    for part in (wordlist.encode(), (version or '').encode(), options.encode(), json.dumps(ranges).encode()):
+        digest.update(part + b'\0')
+    for hash_value in hashes:
+        digest.update(hash_value + b'\n')
+    return digest.hexdigest()[:32]
+
+def expand_hash_files(f):
+    """Return the hash files designated by a file path, a directory or a glob pattern."""
+    if os.path.isdir(f):
+        paths = (os.path.join(f, name) for name in os.listdir(f))
+    elif any(c in f for c in '*?['):
+        paths = glob.glob(f)
+    else:
+        return [f]
+    return sorted(path for path in paths if os.path.isfile(path))
 
-bucket_name = None
-job_definition_arn = None
-job_queue_arn = None
-
-try:
-    with open('build/resources.json', 'r') as file:
-        created_resources = json.load(file)
-        bucket_name = created_resources.get('bucket_name')
-        job_definition_arn = created_resources.get('job_definition_arn')
-        job_queue_arn = created_resources.get('job_queue_arn')
-except Exception as e:
-    print(e)
-
-def get_wordlist_s3(file_name):
-    response = s3.list_objects_v2(Bucket=bucket_name, Prefix=f"{wordlist_folder}/{file_name}")
-    if response['KeyCount'] > 0:
-        for obj in response['Contents']:
-            if obj['Key'] == f"{wordlist_folder}/{file_name}":
-                return f"s3://{bucket_name}/{wordlist_folder}/{file_name}"
-    return None
-
-def crack_hashes(f, w, options, **kwargs):
+def crack_hashes(f, w, options, mask=None, shards=1, auto_size=False, dry_run=False, backend=None,
+                 priority=admission.default_priority, share=None, **kwargs):
     if not bucket_name or not job_definition_arn or not job_queue_arn:
         print("Missing resources, run the setup first.")
         return
-    
-    batch = boto3.client('batch')
-    job_name = "crack_job"
 
-    file_name = f.split('/')[-1]
-    s3.upload_file(f, bucket_name, f"{to_crack_folder}/{file_name}")
-    to_crack_file_path = f"s3://{bucket_name}/{to_crack_folder}/{file_name}"
-    wordlist_file_path = get_wordlist_s3(w)
-    if wordlist_file_path is None:
-        print("Wordlist was not found on the S3 bucket")
+    files = expand_hash_files(f)
+    if not files:
+        print(f"No hash file found for '{f}'.")
+        return
+    # Results are stored by file name, files sharing a name would overwrite each other's
+    names = [path.split('/')[-1] for path in files]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        print(f"Hash files must have distinct names, found several '{', '.join(duplicates)}'.")
+        return
+
+    # Lines are checked against the mode given in options, or each line's mode is detected
+    given_mode = sizing.hash_mode(options) if re.search(r'(?:^|\s)(?:-m|--hash-type)', options) else None
+    members = {}
+    modes = {}
+    sources = {}
+    for path in files:
+        report = ingest.ingest(path, options, given_mode)
+        ingest.print_report(path.split('/')[-1], report, given_mode)
+        # Mixed files are split into one member per mode, named after the mode
+        stem, ext = os.path.splitext(path)
+        for mode, hashes in report['hashes'].items():
+            member = path if len(report['hashes']) == 1 else f"{stem}-m{mode}{ext}"
+            members[member] = hashes
+            modes[member] = mode
+            sources[member] = path.split('/')[-1]
+            if member != path:
+                print(f"  -m {mode} hashes are cracked as '{member.split('/')[-1]}'.")
+    if not members:
+        print("No valid hashes to crack.")
         return
-    
-    vCPU = 1
-    MEMORY = 2048
 
-    try:
-        with open('config.json', 'r') as file:
-            config = json.load(file)
-            vCPU = config['vCPU']
-            MEMORY = config['MEMORY']  
-    except Exception as e:
+    # Only submit the hashes that are not in the local potfile yet
+    username = re.search(r'(?:^|\s)--username(?:\s|$)', options) is not None
+    for path in list(members):
+        hashes = members.pop(path)
+        remaining, known = potfile.partition(hashes, username)
+        prefix = f"{path.split('/')[-1]}: " if len(modes) > 1 else ""
+        if known:
+            print(f"{prefix}{len(hashes) - len(remaining)} of {len(hashes)} hashes already cracked:")
+            for hash_value, plain in known:
+                print((hash_value + b':' + plain).decode(errors='replace'))
+        if remaining:
+            members[path] = remaining
+        elif len(modes) > 1:
+            print(f"{prefix}all hashes are already cracked, skipping.")
+    if not members:
+        print("All hashes are already cracked, nothing to submit.")
+        return
+
+    config = settings.load_config()
+    if not config:
         print("No config file found, using default.")
+    share = share or config.get('SHARE', admission.default_share)
+
+    # Files cracked with the same hash mode share a job, and a single wordlist download
+    groups = {}
+    for path in members:
+        groups.setdefault(modes[path], []).append(path)
 
-    command = ["/tmp/run.sh"]
+    # The attack of every mode is checked before any job is submitted, so a split file is cracked whole or not at all
+    group_options = {mode: options if given_mode is not None else f"-m {mode} {options}".strip() for mode in groups}
+    plans = {}
+    for mode in groups:
+        plans[mode] = plan_attack(w, mask, group_options[mode])
+        if plans[mode] is None:
+            if len(groups) > 1:
+                print(f"The -m {mode} hashes cannot be cracked with this attack, no job was submitted.")
+            return
+
+    job_ids = []
+    try:
+        for mode, paths in groups.items():
+            group = {path: members[path] for path in paths}
+            job_id = crack_group(
+                f, group, w, plans[mode], group_options[mode], mode, shards, config, backend, priority, share, auto_size, dry_run, sources
+            )
+            if job_id:
+                job_ids.append(job_id)
+    except BaseException:
+        if job_ids:
+            print(f"{len(job_ids)} of {len(groups)} jobs were submitted before the error: {', '.join(job_ids)}")
+        raise
+    return job_ids
+
+def crack_group(f, members, w, plan, options, mode, shards, config, backend, priority, share, auto_size, dry_run, sources=None):
+    """Size and submit the job of files sharing a hash mode, the attack was planned by plan_attack."""
+    remaining = [hash_value for hashes in members.values() for hash_value in hashes]
+    backend = backend or config.get('BACKEND', backends.default_backend)
+    if backend == 'auto':
+        wordlist_size = plan['entry']['size'] if plan['entry'] else 0
+        backend = backends.choose_backend(mode, plan['candidates'], sizing.salt_count(mode, remaining), wordlist_size)
+    if backend == 'local' and shards > 1:
+        print("The local backend runs each job as a single task, --shards is ignored.")
+        shards = 1
+    if backend != 'local' and auto_size and shards == 1 and plan['attack'] in keyspace_attacks:
+        # Large masks are spread over enough slices to finish within the target runtime
+        shards = sizing.choose_shards(
+            mode, plan['candidates'], sizing.salt_count(mode, remaining), config.get('vCPU', 1), min(plan['base'], max_shards)
+        )
+    if shards > 1:
+        if plan['attack'] in keyspace_attacks:
+            plan['slices'] = keyspace.get_slices(plan['base'], min(shards, max_shards))
+        else:
+            plan['ranges'] = get_wordlist_shards(w, plan['entry'], min(shards, max_shards))
+
+    return submit_crack(f, members, plan, options, mode, config, backend, priority, share, auto_size, dry_run, sources)
+
+def plan_attack(w, mask, options):
+    """
+    Check the inputs of the attack mode given in options and work out its keyspace.
+    Returns None when the attack cannot be run.
+    """
+    attack = keyspace.attack_mode(options)
+    if attack not in attack_inputs:
+        print(f"Attack mode {attack} is not supported, use -a 0, 3, 6 or 7.")
+        return None
+    inputs = attack_inputs[attack]
+    if 'wordlist' in inputs and not w:
+        print(f"Attack mode {attack} needs a wordlist, use -w.")
+        return None
+    if 'mask' in inputs and not mask:
+        print(f"Attack mode {attack} needs a mask, use --mask.")
+        return None
+    if re.search(r'(?:^|\s)(?:-i|--increment)(?:\s|$)', options):
+        print("Increment mode is not supported, submit one job per mask length.")
+        return None
+
+    plan = {
+        'attack': attack,
+        'wordlist': w if 'wordlist' in inputs else None,
+        'mask': mask if 'mask' in inputs else None,
+        'entry': None,
+        'ranges': [],
+        'slices': [],
+    }
+    lines = 1
+    if plan['wordlist']:
+        plan['entry'] = catalog.get_wordlist(bucket_name, w)
+        if plan['entry'] is None:
+            print("Wordlist was not found on the S3 bucket")
+            return None
+        # Wordlists uploaded before the manifest have no line count, assume 10 bytes per candidate
+        lines = plan['entry'].get('lines', plan['entry']['size'] // 10)
+    base, candidates = lines, lines
+    if plan['mask']:
+        try:
+            base, mask_candidates = keyspace.mask_keyspace(mask, options, sizing.hash_mode(options))
+        except ValueError as e:
+            print(e)
+            return None
+        candidates = lines * mask_candidates
+        if attack == 6:
+            base = lines
+        elif attack == 7:
+            base = mask_candidates
+    # --skip and --limit count in base words, the unit hashcat's --keyspace reports
+    plan['base'] = base
+    plan['candidates'] = candidates
+    return plan
+
+def upload_hashes(members):
+    """Upload the hashes left to crack of each file concurrently, returns their S3 paths."""
+    def upload(path):
+        key = f"{to_crack_folder}/{path.split('/')[-1]}"
+        s3.put_object(Bucket=bucket_name, Key=key, Body=b'\n'.join(members[path]) + b'\n')
+        return f"s3://{bucket_name}/{key}"
+
+    with ThreadPoolExecutor(max_workers=upload_workers) as executor:
+        return list(executor.map(upload, members))
+
+def submit_crack(f, members, plan, options, mode, config, backend, priority, share, auto_size=False, dry_run=False, sources=None):
+    """
+    Submit one job cracking the remaining hashes of members, a dict of hash lists keyed by file path.
+    sources gives the name of the file each member comes from, for lists split per mode.
+    """
+    job_name = "crack_job"
+
+    vCPU = config.get('vCPU', 1)
+    MEMORY = config.get('MEMORY', 2048)
+    ranges = plan['ranges'] or plan['slices']
+    shard_count = max(len(ranges), 1)
+    wordlist_size = plan['entry']['size'] if plan['entry'] else 0
+    inputs = {
+        'wordlist': f"s3://{bucket_name}/{wordlist_folder}/{plan['wordlist']}",
+        'mask': plan['mask'],
+    }
+    chunks = plan['entry'].get('chunks') if plan['entry'] else None
+    if chunks:
+        # The container reads the version manifest and streams its chunks in order
+        inputs['wordlist'] = f"s3://{bucket_name}/{chunks}"
+    attack_args = [inputs[name] for name in attack_inputs[plan['attack']]]
+    description = " ".join(plan['wordlist'] if name == 'wordlist' else plan['mask'] for name in attack_inputs[plan['attack']])
+
+    remaining = [hash_value for hashes in members.values() for hash_value in hashes]
+    salts = sizing.salt_count(mode, remaining)
+    candidates = plan['candidates']
+    if backend == 'local':
+        vCPU, MEMORY = os.cpu_count() or 1, 0
+    elif auto_size:
+        vCPU, MEMORY = sizing.choose_size(mode, candidates, salts, len(remaining), wordlist_size, shard_count)
+    if auto_size or dry_run or plan['mask']:
+        seconds = sizing.estimate_seconds(mode, candidates, salts, wordlist_size, vCPU, shard_count)
+        cost = sizing.estimate_cost(seconds, vCPU, MEMORY, shard_count)
+        files = f", {len(members)} files" if len(members) > 1 else ""
+        print(f"Mode {mode}: {len(remaining)} hashes{files}, {salts} salts, {candidates} candidates, {shard_count} shards.")
+        if plan['mask']:
+            print(f"Keyspace: {plan['base']} base words of {candidates // plan['base']} candidates each.")
+        resources = "local machine" if backend == 'local' else f"{vCPU} vCPU, {MEMORY} MB"
+        print(f"Resources: {resources}. Estimated runtime {datetime.timedelta(seconds=int(seconds))}, cost ${cost:.4f}.")
+    if dry_run:
+        return
+
+    # A new version of a wordlist does not resume from the checkpoints of the previous one
+    version = (plan['entry'].get('sha256') or plan['entry'].get('etag')) if plan['entry'] else None
+    checkpoint = checkpoint_id(remaining, description, options, ranges, version)
+    hash_paths = upload_hashes(members)
+    environment = [
+        {
+            'name': 'CHECKPOINT_ID',
+            'value': checkpoint
+        }
+    ]
+    if len(members) > 1:
+        # The container cracks the listed files together and splits the results back per file
+        file_name = f"group-{checkpoint[:16]}"
+        s3.put_object(Bucket=bucket_name, Key=f"{to_crack_folder}/{file_name}", Body="".join(f"{path}\n" for path in hash_paths).encode())
+        to_crack_file_path = f"s3://{bucket_name}/{to_crack_folder}/{file_name}"
+        environment.append({'name': 'HASH_GROUP', 'value': '1'})
+        print(f"{len(members)} hash files packed into one job.")
+    else:
+        file_name = next(iter(members)).split('/')[-1]
+        to_crack_file_path = hash_paths[0]
+    if chunks:
+        environment.append({'name': 'WORDLIST_CHUNKS', 'value': '1'})
+
+    command = ["python3", "/tmp/run.py"]
     command.extend(options.split(" "))
     command.append("-w")
     command.append("4")
     command.append(to_crack_file_path)
-    command.append(wordlist_file_path)
-
-    response = batch.submit_job(
-        jobName=job_name,
-        jobQueue=job_queue_arn,
-        jobDefinition=job_definition_arn,
-        containerOverrides={
-            'command': command,
-            'resourceRequirements': [
-                {
-                    'value': f"{vCPU}",
-                    'type': 'VCPU'
-                },
-                {
-                    'value': f"{MEMORY}",
-                    'type': 'MEMORY'
-                },
-            ],
-        }
-    )
+    command.extend(attack_args)
 
-    job_id = response['jobId']
-    jobs = []
-
-    try:
-        with open('build/jobs.json', 'r') as file:
-            jobs = json.load(file)
-    except Exception as e:
-        jobs = []
-    finally:
-        jobs.append({
-            "id": job_id,
-            "file": f
+    array_size = 1
+    if len(plan['slices']) > 1:
+        # Each child of the array job cracks its slice of the keyspace, computed from AWS_BATCH_JOB_ARRAY_INDEX.
+        environment.extend([
+            {'name': 'KEYSPACE', 'value': str(plan['base'])},
+            {'name': 'KEYSPACE_SLICES', 'value': str(len(plan['slices']))},
+        ])
+        array_size = len(plan['slices'])
+        print(f"Keyspace split into {len(plan['slices'])} slices.")
+    elif len(ranges) > 1:
+        # Each child of the array job reads its byte range from this file using AWS_BATCH_JOB_ARRAY_INDEX.
+        # The file is named after the checkpoint of the job, another job on the same hash file has its own.
+        shards_key = f"{shards_folder}/{checkpoint}"
+        s3.put_object(
+            Bucket=bucket_name,
+            Key=shards_key,
+            Body="".join(f"{start}-{end}\n" for start, end in ranges).encode()
+        )
+        environment.append({
+            'name': 'WORDLIST_SHARDS',
+            'value': f"s3://{bucket_name}/{shards_key}"
         })
+        array_size = len(ranges)
+        print(f"Wordlist split into {len(ranges)} shards.")
 
-    try:
-        with open('build/jobs.json', 'w') as file:
-            file.write(json.dumps(jobs))
-    except Exception as e:
-        print(e)
+    job = dict(
+        file=f if len(members) > 1 else next(iter(members)),
+        wordlist=description,
+        options=options,
+        vcpu=vCPU,
+        memory=MEMORY,
+        shards=shard_count,
+        submitted=int(datetime.datetime.now().timestamp() * 1000),
+        hash_mode=mode,
+        hash_count=len(remaining),
+        salt_count=salts,
+        candidates=candidates,
+        wordlist_size=wordlist_size,
+        files=[(path, len(hashes), (sources or {}).get(path, path.split('/')[-1])) for path, hashes in members.items()],
+        backend=backend,
+        priority=priority,
+        share=share,
+        file_name=file_name
+    )
+    if backend != 'batch':
+        job_id = backends.get_backend(backend).submit(job_name, command, environment, vCPU, MEMORY, array_size, config, priority)
+        print(f"Job submitted to the {backend} backend.")
+        jobstore.add_job(job_id, **job)
+        return job_id
 
+    # Batch jobs go through admission, which holds them while the compute environments are full
+    held_id = f"held-{uuid.uuid4()}"
+    jobstore.add_job(held_id, **job, spec={
+        'job_name': job_name,
+        'command': command,
+        'environment': environment,
+        'vcpu': vCPU,
+        'memory': MEMORY,
+        'array_size': array_size,
+    })
+    job_id = admission.admit(config).get(held_id)
+    if not job_id:
+        print(f"Job held until there are {vCPU * shard_count} vCPUs free, 'crack status' and 'crack watch' submit it then.")
+        return held_id
     return job_id
 
-def crack_jobs_status(**kwargs):
-    try:
-        with open('build/jobs.json', 'r') as file:
-            file_content = file.read()
-            jobs = json.loads(file_content)
-    except:
-        jobs = []
-    
-    if jobs:
-        job_ids = [j['id'] for j in jobs]
-
-        batch = boto3.client('batch')
-        response = batch.describe_jobs(
-            jobs=job_ids
-        )
-        job_statuses = response['jobs']
+def parse_since(since):
+    """Parse a relative duration (30m, 2h, 7d) or an ISO date into a timestamp in milliseconds."""
+    match = re.fullmatch(r'(\d+)([smhd])', since)
+    if match:
+        unit = {'s': 'seconds', 'm': 'minutes', 'h': 'hours', 'd': 'days'}[match.group(2)]
+        since_dt = datetime.datetime.now() - datetime.timedelta(**{unit: int(match.group(1))})
+    else:
+        since_dt = datetime.datetime.fromisoformat(since)
+    return int(since_dt.timestamp() * 1000)
+
+def refresh_job_statuses(jobs):
+    """Fetch the current state of jobs from the API and store it in the job store."""
+    if not jobs:
+        return {}
+    job_ids = {}
+    for j in jobs:
+        # Held jobs are not submitted yet
+        if j['status'] not in ('HELD', 'ADMITTING'):
+            job_ids.setdefault(j.get('backend') or backends.default_backend, []).append(j['id'])
+    job_statuses = {}
+    for name, ids in job_ids.items():
+        job_statuses.update(backends.get_backend(name).describe(ids))
+    jobstore.update_statuses(job_statuses)
+    # Jobs the backend has forgotten will never finish, they stop being watched and holding capacity
+    now = int(time.time() * 1000)
+    missing = [
+        j['id'] for j in jobs
+        if j['status'] not in ('HELD', 'ADMITTING') and j['id'] not in job_statuses
+        and now - (j['submitted'] or 0) > missing_job_delay
+    ]
+    if missing:
+        jobstore.mark_unknown(missing)
+        job_statuses.update({job_id: {'jobId': job_id, 'status': 'UNKNOWN'} for job_id in missing})
+    # Capacity freed by finished jobs goes to the held ones
+    admitted = admission.admit()
+    if admitted:
+        print(f"{len(admitted)} held jobs submitted.", file=sys.stderr)
+
+    # Runtimes of newly finished jobs feed the throughput model used by --auto-size
+    finished = []
+    for j in jobs:
+        js = job_statuses.get(j['id'])
+        if js and js['status'] == 'SUCCEEDED':
+            job = {**j, 'status': js['status'], 'started_at': js.get('startedAt'), 'stopped_at': js.get('stoppedAt')}
+            # The children of array jobs do not all run at once, each of them is timed on its own
+            if 'arrayProperties' in js and (j.get('backend') or backends.default_backend) == 'batch':
+                job['child_runtimes'] = backends.get_backend('batch').child_runtimes(j['id'])
+            finished.append(job)
+    sizing.record_jobs(finished)
+    return job_statuses
+
+def read_progress(key):
+    return json.loads(s3.get_object(Bucket=bucket_name, Key=key)['Body'].read())
+
+def combine_progress(records):
+    """Sum the progress records of the children of a job, the ETA assumes the current combined speed."""
+    speed = sum(r['speed'] for r in records)
+    done = sum(r['progress'][0] for r in records)
+    total = sum(r['progress'][1] for r in records)
+    hashes = max(r['recovered'][1] for r in records)
+    recovered = min(sum(r['recovered'][0] for r in records), hashes)
+    eta = (total - done) / speed if speed and total > done else None
+    return {'speed': speed, 'progress': (done, total), 'recovered': (recovered, hashes), 'eta': eta}
+
+def fetch_progress(job_ids):
+    """Fetch the progress records of jobs concurrently, returns the combined progress keyed by job ID."""
+    def list_keys(job_id):
+        paginator = s3.get_paginator('list_objects_v2')
+        return [obj['Key'] for page in paginator.paginate(Bucket=bucket_name, Prefix=f"{progress_folder}/{job_id}/") for obj in page.get('Contents', [])]
+
+    with ThreadPoolExecutor(max_workers=result_workers) as executor:
+        keys = dict(zip(job_ids, executor.map(list_keys, job_ids)))
+        all_keys = [key for job_keys in keys.values() for key in job_keys]
+        records = dict(zip(all_keys, executor.map(read_progress, all_keys)))
+    return {job_id: combine_progress([records[key] for key in job_keys]) for job_id, job_keys in keys.items() if job_keys}
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+    duration = f"{hours}h:{minutes}m:{seconds}s"
+    return f"{days}d:{duration}" if days else duration
+
+def format_speed(speed):
+    for unit in ('', 'k', 'M', 'G', 'T'):
+        if speed < 1000:
+            break
+        speed /= 1000
+    return f"{speed:.1f} {unit}H/s"
+
+def crack_jobs_status(filter=None, since=None, **kwargs):
+    since_ms = parse_since(since) if since else None
+
+    # Finished jobs are never queried again, only the live ones are refreshed
+    if not filter or any(status not in terminal_statuses for status in filter):
+        refresh_job_statuses(jobstore.get_jobs(since=since_ms, live=True))
+    jobs = jobstore.get_jobs(statuses=filter, since=since_ms)
+    progress = fetch_progress([j['id'] for j in jobs if j['status'] == 'RUNNING'])
 
     jobs_list = []
-    headers = ['Hash File', 'Status', 'Runtime']
+    headers = ['Hash File', 'Status', 'Runtime', 'Speed', 'Progress', 'Recovered', 'ETA']
 
     for j in jobs:
-        for js in job_statuses:
-            if j['id'] == js['jobId']:
-                status = js['status']
-                interval_dt = None
-                time_taken = '-'
-                if status == 'SUCCEEDED' or status == 'FAILED':
-                    started_dt = datetime.datetime.fromtimestamp(js['startedAt']/1000)
-                    stopped_dt = datetime.datetime.fromtimestamp(js['stoppedAt']/1000)
-                    interval_dt = stopped_dt - started_dt
-                elif status == 'RUNNING':
-                    started_dt = datetime.datetime.fromtimestamp(js['startedAt']/1000)
-                    now = datetime.datetime.now()
-                    interval_dt = now - started_dt
-
-                if interval_dt != None:
-                    hours = interval_dt.seconds // 3600
-                    minutes = interval_dt.seconds // 60
-                    seconds = interval_dt.seconds % 60
-                    time_taken =  f"{hours}h:{minutes}m:{seconds}s"
-                jobs_list.append([j['file'], status, time_taken])
-                break
+        status = j['status']
+        interval_dt = None
+        time_taken = '-'
+        # Jobs that failed or were cancelled before starting have no start time
+        if status in ('SUCCEEDED', 'FAILED') and j['started_at'] and j['stopped_at']:
+            started_dt = datetime.datetime.fromtimestamp(j['started_at']/1000)
+            stopped_dt = datetime.datetime.fromtimestamp(j['stopped_at']/1000)
+            interval_dt = stopped_dt - started_dt
+        elif status == 'RUNNING' and j['started_at']:
+            started_dt = datetime.datetime.fromtimestamp(j['started_at']/1000)
+            now = datetime.datetime.now()
+            interval_dt = now - started_dt
+
+        if interval_dt != None:
+            time_taken = format_duration(interval_dt.total_seconds())
+        if 'arrayProperties' in j['details']:
+            array_properties = j['details']['arrayProperties']
+            summary = array_properties.get('statusSummary', {})
+            status = f"{status} ({summary.get('SUCCEEDED', 0)}/{array_properties['size']} shards)"
+        row = [j['file'], status, time_taken, '-', '-', '-', '-']
+        if j['id'] in progress:
+            p = progress[j['id']]
+            done, total = p['progress']
+            row[3] = format_speed(p['speed'])
+            row[4] = f"{100 * done / total:.1f}%" if total else '-'
+            row[5] = f"{p['recovered'][0]}/{p['recovered'][1]}"
+            row[6] = format_duration(p['eta']) if p['eta'] is not None else '-'
+        jobs_list.append(row)
     print(tabulate(jobs_list, headers=headers))
-         
-def get_results(f, **kwargs):
-    s3 = boto3.client('s3')
+
+def get_result_keys(f):
+    """Return the result key of a file, or the keys of each shard for array jobs."""
+    keys = []
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=f"cracked/{f}"):
+        for obj in page.get('Contents', []):
+            if obj['Key'] == f"cracked/{f}" or obj['Key'].startswith(f"cracked/{f}.shard"):
+                keys.append(obj['Key'])
+    return keys
+
+def result_exists(key):
     try:
-        s3.download_file(bucket_name, f"cracked/{f}", f"cracked.txt")
-    except Exception as e:
-        print(f"Cracked file not available. Either the job is still running or the hash was not cracked.")
+        s3.head_object(Bucket=bucket_name, Key=key)
+    except ClientError:
+        return False
+    return True
+
+def find_result_keys(file_name, shards):
+    """Return the result keys that exist for a job, using HEAD requests when the shard count is known."""
+    if shards and shards > 1:
+        keys = [f"{results_folder}/{file_name}.shard{i}" for i in range(shards)]
+    elif shards:
+        keys = [f"{results_folder}/{file_name}"]
     else:
+        return get_result_keys(file_name)
+    return [key for key in keys if result_exists(key)]
+
+def download_results(job_id, file_name, keys):
+    """
+    Download the result keys of a job into a single local file, under a directory per job for jobs in the
+    job store. The file is written to a temporary name first, so concurrent downloads never mix.
+    """
+    directory = os.path.join(results_folder, job_id) if job_id else results_folder
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, file_name)
+    descriptor, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{file_name}.", suffix='.part')
+    try:
+        with os.fdopen(descriptor, 'wb') as file:
+            # Each object is appended in turn, download_fileobj writes at the offsets of its own object
+            for key in keys:
+                shutil.copyfileobj(s3.get_object(Bucket=bucket_name, Key=key)['Body'], file)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return path
+
+def print_lines(lines):
+    """Print lines while passing them through, so results are shown without being buffered."""
+    for line in lines:
+        print(line.rstrip(b'\r\n').decode(errors='replace'))
+        yield line
+
+def get_results(f=None, all=False, **kwargs):
+    if not f and not all:
+        print("Specify a file with -f or use --all.")
+        return
+
+    # Results are looked up per job and result name with the shard count of that job,
+    # names unknown to the job store are looked up on their own
+    targets = {}
+    job_files = jobstore.get_job_files(file_pattern=None if all else f)
+    modes = {jf['job_id']: jf['hash_mode'] for jf in job_files}
+    for jf in job_files:
+        # Packed jobs upload the lines they cannot attribute to a file under the name of the job
+        for name in {jf['file_name'], jf['job_file_name']}:
+            targets[(jf['job_id'], name)] = jf['shards']
+    if f and not any(c in f for c in '*?[') and not job_files:
+        targets[(None, f)] = None
+
+    with ThreadPoolExecutor(max_workers=result_workers) as executor:
+        found = dict(zip(targets, executor.map(lambda target: find_result_keys(target[1], targets[target]), targets)))
+        # Jobs cracking a file under the same name overwrite its result, which belongs to the latest of them
+        owners = {key: target for target, keys in found.items() for key in keys}
+        found = {target: [key for key in keys if owners[key] == target] for target, keys in found.items()}
+        found = {target: keys for target, keys in found.items() if keys}
+        paths = dict(zip(found, executor.map(lambda target: download_results(*target, found[target]), found)))
+
+    if not paths:
+        print(f"Cracked file not available. Either the job is still running or the hash was not cracked.")
+        return
+
+    added = 0
+    for target, path in paths.items():
+        with open(path, 'rb') as file:
+            added += potfile.add_results(print_lines(file) if len(paths) == 1 else file, modes.get(target[0]))
+    if len(paths) > 1:
+        print(f"Results for {len(paths)} files downloaded to '{results_folder}/<job ID>/'.")
+    if added:
+        print(f"{added} new results added to the potfile.")
+
+def stream_result(key):
+    """Print the lines of a result object as they are downloaded and yield them for the potfile."""
+    body = s3.get_object(Bucket=bucket_name, Key=key)['Body']
+    for line in body.iter_lines():
+        print(line.decode(errors='replace'), flush=True)
+        yield line
+
+def watch_jobs(interval=5, max_interval=120, **kwargs):
+    pending = {j['id']: j for j in jobstore.get_jobs(live=True)}
+    if not pending:
+        print("No running jobs to watch.")
+        return
+
+    previous = {}
+    streamed_keys = set()
+    delay = interval
+    while pending:
         try:
-            with open('cracked.txt', 'r') as file:
-                file_content = file.read()
-                print(file_content)
-        except:
-            print("Unknown error happened")
\ No newline at end of file
+            job_statuses = refresh_job_statuses(list(pending.values()))
+        except ClientError as e:
+            if e.response['Error']['Code'] not in throttling_errors:
+                raise
+            job_statuses = {}
+        changed = False
+
+        for job_id, js in job_statuses.items():
+            j = pending[job_id]
+            status = js['status']
+            summary = js.get('arrayProperties', {}).get('statusSummary', {})
+            progress = (status, summary.get('SUCCEEDED', 0))
+            if progress == previous.get(job_id):
+                continue
+            changed = True
+            previous[job_id] = progress
+            print(f"[{j['file']}] {status}", file=sys.stderr)
+
+            # Shards of array jobs are downloaded as soon as each of them succeeds
+            if status == 'SUCCEEDED' or summary.get('SUCCEEDED'):
+                job_files = jobstore.get_job_files([job_id])
+                names = {name for jf in job_files for name in (jf['file_name'], jf['job_file_name'])}
+                for name in names:
+                    for key in find_result_keys(name, j['shards']):
+                        if key in streamed_keys:
+                            continue
+                        streamed_keys.add(key)
+                        potfile.add_results(stream_result(key), j['hash_mode'])
+
+            if status in terminal_statuses:
+                del pending[job_id]
+
+        # Held jobs admitted during the refresh are watched under their new job ID
+        if any(j['status'] in ('HELD', 'ADMITTING') for j in pending.values()):
+            pending = {j['id']: j for j in jobstore.get_jobs(live=True)}
+        if not pending:
+            break
+        # Poll again quickly after a change, back off exponentially while nothing happens
+        delay = interval if changed else min(delay * 2, max_interval)
+        time.sleep(random.uniform(delay / 2, delay))
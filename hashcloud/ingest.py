@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# File name          : ingest.py
+# Author             : TomPh
+# Date created       : 29 May 2023
+
+"""
+Check hash files before they are submitted: every line is classified by hash mode, invalid lines are
+dropped and reported, duplicates are removed, and mixed files are split into one list per mode.
+Large files are split into line-aligned chunks classified on every core.
+"""
+
+import itertools
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+from hashcloud import prepare
+
+# Input bytes classified by a worker at once.
+chunk_size = 16 * 1024 * 1024
+# Invalid lines printed per file, the others are only counted.
+invalid_samples = 5
+
+b64 = rb'[./0-9A-Za-z]'
+# Hash formats in detection order, a line takes the mode of the first pattern it fully matches.
+# Plain hex digests come first as they are the most common and match no other format.
+# Formats several modes share are detected as the first one, the others are listed as alternatives.
+patterns = [
+    (0, rb'[0-9a-fA-F]{32}', (1000, 900)),
+    (100, rb'[0-9a-fA-F]{40}', (6000,)),
+    (1400, rb'[0-9a-fA-F]{64}', (17400, 11700)),
+    (10800, rb'[0-9a-fA-F]{96}', (17500,)),
+    (1700, rb'[0-9a-fA-F]{128}', (17600, 6100)),
+    (5600, rb'[^:]+::[^:]*:[0-9a-fA-F]{16}:[0-9a-fA-F]{32}:[0-9a-fA-F]+', ()),
+    (5500, rb'[^:]+::[^:]*:[0-9a-fA-F]{48}:[0-9a-fA-F]{48}:[0-9a-fA-F]{16}', ()),
+    (13100, rb'\$krb5tgs\$23\$.+\$[0-9a-fA-F]{32}\$[0-9a-fA-F]+', ()),
+    (18200, rb'\$krb5asrep\$23\$.+[:$][0-9a-fA-F]{32}\$[0-9a-fA-F]+', ()),
+    (22000, rb'WPA\*0[12]\*[0-9a-fA-F]{32}\*[0-9a-fA-F]{12}\*[0-9a-fA-F]{12}\*[0-9a-fA-F]*\*.*', ()),
+    (2100, rb'\$DCC2\$\d+#[^#]+#[0-9a-fA-F]{32}', ()),
+    (3200, rb'\$2[abxy]?\$\d{2}\$' + b64 + rb'{53}', ()),
+    (500, rb'\$1\$' + b64 + rb'{0,8}\$' + b64 + rb'{22}', ()),
+    (7400, rb'\$5\$(?:rounds=\d+\$)?' + b64 + rb'{0,16}\$' + b64 + rb'{43}', ()),
+    (1800, rb'\$6\$(?:rounds=\d+\$)?' + b64 + rb'{0,16}\$' + b64 + rb'{86}', ()),
+    (400, rb'\$[PH]\$' + b64 + rb'{31}', ()),
+    (13400, rb'\$keepass\$\*[1-4]\*.+', ()),
+    (11600, rb'\$7z\$.+', ()),
+    (9400, rb'\$office\$\*2007\*.+', ()),
+    (9500, rb'\$office\$\*2010\*.+', ()),
+    (9600, rb'\$office\$\*2013\*.+', ()),
+    (10900, rb'sha256:\d+:[A-Za-z0-9+/=]+:[A-Za-z0-9+/=]+', ()),
+    (1731, rb'0x0200[0-9a-fA-F]{136}', ()),
+    (132, rb'0x0100[0-9a-fA-F]{48}', ()),
+    (300, rb'\*[0-9a-fA-F]{40}', ()),
+]
+alternatives = {mode: others for mode, _, others in patterns if others}
+# Lines given with -m are checked against the format of the mode, shared formats included
+formats = {mode: pattern for mode, pattern, others in patterns for mode in (mode, *others)}
+mode_patterns = {mode: re.compile(pattern) for mode, pattern in formats.items()}
+# A single automaton tries every format in order, the name of the matching group gives the mode
+detector = re.compile(b'|'.join(b'(?P<m%d>%s)' % (mode, pattern) for mode, pattern, _ in patterns))
+
+def detect(hash_value):
+    """Return the hash mode of a hash, or None when it matches no known format."""
+    match = detector.fullmatch(hash_value)
+    return int(match.lastgroup[1:]) if match else None
+
+def _chunk_pattern(mode, username):
+    """Pattern finding the valid lines of a mode in a whole chunk, with the user part of --username lines."""
+    user = rb'[^:\n]*:' if username else b''
+    return re.compile(rb'^(' + user + rb'(?:' + formats[mode] + rb'))$', re.MULTILINE)
+
+def _classify_chunk(path, start, end, mode, username):
+    """
+    Classify the lines of one line-aligned chunk. Returns the number of lines, the valid lines by mode,
+    the number of invalid lines and the first of them with their line number in the chunk.
+    """
+    with open(path, 'rb') as file:
+        file.seek(start)
+        data = file.read(end - start)
+    line_count = data.count(b'\n') + (not data.endswith(b'\n'))
+
+    # Most chunks hold a single format: when every line matches the mode of the first one, the chunk
+    # is checked by the regex engine alone. Chunks with mixed formats, blank lines or CRLF endings are
+    # classified line by line.
+    first = data[:data.find(b'\n')] if b'\n' in data else data
+    chunk_mode = mode if mode is not None else detect(first.split(b':', 1)[-1] if username else first)
+    if chunk_mode in mode_patterns and b'\r' not in data:
+        matches = _chunk_pattern(chunk_mode, username).findall(data)
+        if len(matches) == line_count:
+            return line_count, {chunk_mode: matches}, 0, []
+
+    pattern = mode_patterns.get(mode)
+    hashes = {}
+    invalid = 0
+    samples = []
+    lines = data.split(b'\n')
+    if lines and not lines[-1]:
+        lines.pop()
+    for number, line in enumerate(lines):
+        line = line.rstrip(b'\r')
+        if not line.strip():
+            continue
+        # With --username, lines are user:hash and only the hash is checked
+        hash_value = line.split(b':', 1)[-1] if username else line
+        if mode is None:
+            line_mode = detect(hash_value)
+        else:
+            line_mode = mode if pattern is None or pattern.fullmatch(hash_value) else None
+        if line_mode is not None:
+            hashes.setdefault(line_mode, []).append(line)
+            continue
+        invalid += 1
+        if len(samples) < invalid_samples:
+            samples.append((number, line))
+    return len(lines), hashes, invalid, samples
+
+def ingest(path, options, mode=None, workers=None):
+    """
+    Classify, validate and deduplicate the lines of a hash file. With a mode, lines are checked against its
+    format, unknown modes accept any line; without one, each line's mode is detected.
+    Returns a dict with the hashes of each mode in file order, the line, invalid and duplicate counts,
+    and samples of invalid lines with their line number.
+    """
+    username = re.search(r'(?:^|\s)--username(?:\s|$)', options) is not None
+    size = os.path.getsize(path)
+    chunks = prepare.line_chunks(path, size, chunk_size)
+    workers = min(workers or os.cpu_count() or 1, len(chunks))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_classify_chunk, *zip(*[(path, start, end, mode, username) for start, end in chunks])))
+    else:
+        results = [_classify_chunk(path, start, end, mode, username) for start, end in chunks]
+
+    report = {'hashes': {}, 'lines': 0, 'invalid': 0, 'duplicates': 0, 'samples': []}
+    valid = {}
+    for lines, hashes, invalid, samples in results:
+        report['samples'].extend((report['lines'] + number + 1, line) for number, line in samples)
+        report['lines'] += lines
+        report['invalid'] += invalid
+        for line_mode, mode_hashes in hashes.items():
+            valid.setdefault(line_mode, []).append(mode_hashes)
+    # Duplicates are dropped once all chunks are in, keeping the first occurrence of each line
+    for line_mode, parts in valid.items():
+        report['hashes'][line_mode] = list(dict.fromkeys(itertools.chain.from_iterable(parts)))
+        report['duplicates'] += sum(len(part) for part in parts) - len(report['hashes'][line_mode])
+    report['samples'] = report['samples'][:invalid_samples]
+    return report
+
+def print_report(name, report, mode=None):
+    """Print what ingestion dropped from a file and the modes it found."""
+    counts = ", ".join(f"-m {line_mode}: {len(hashes)}" for line_mode, hashes in report['hashes'].items())
+    print(f"{name}: {report['lines']} lines, {report['invalid']} invalid, {report['duplicates']} duplicates. {counts or 'No valid hashes.'}")
+    for number, line in report['samples']:
+        hint = ""
+        if mode is not None:
+            detected = detect(line)
+            hint = f" (looks like -m {detected})" if detected is not None else ""
+        print(f"  line {number} dropped{hint}: {line[:100].decode(errors='replace')}")
+    if mode is None:
+        for line_mode in report['hashes']:
+            if line_mode in alternatives:
+                others = ", ".join(f"-m {other}" for other in alternatives[line_mode])
+                print(f"  -m {line_mode} hashes have the same format as {others}, pass -m in --options to crack them as another mode.")
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# File name          : jobstore.py
+# Author             : TomPh
+# Date created       : 29 May 2023
+
+import json
+import os
+import sqlite3
+import time
+
+jobstore_path = 'build/jobs.db'
+legacy_jobs_path = 'build/jobs.json'
+
+# UNKNOWN jobs are no longer described by their backend, their outcome cannot be known.
+terminal_statuses = ('SUCCEEDED', 'FAILED', 'UNKNOWN')
+# Every status a job can be stored with: held by admission, claimed while being submitted, then the job states of Batch.
+statuses = ('HELD', 'ADMITTING', 'SUBMITTED', 'PENDING', 'RUNNABLE', 'STARTING', 'RUNNING', *terminal_statuses)
+# Milliseconds after which a job left ADMITTING by a process that died is held again
+claim_timeout = 15 * 60 * 1000
+
+schema = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    file TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    wordlist TEXT,
+    options TEXT,
+    vcpu REAL,
+    memory INTEGER,
+    shards INTEGER NOT NULL DEFAULT 1,
+    hash_mode INTEGER,
+    hash_count INTEGER,
+    salt_count INTEGER,
+    candidates INTEGER,
+    wordlist_size INTEGER,
+    submitted INTEGER,
+    status TEXT,
+    created_at INTEGER,
+    started_at INTEGER,
+    stopped_at INTEGER,
+    details TEXT,
+    backend TEXT,
+    priority TEXT,
+    share TEXT,
+    spec TEXT,
+    claimed_at INTEGER
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);
+CREATE INDEX IF NOT EXISTS jobs_hash_mode ON jobs (hash_mode);
+CREATE INDEX IF NOT EXISTS jobs_file_name ON jobs (file_name);
+CREATE INDEX IF NOT EXISTS jobs_submitted ON jobs (submitted);
+CREATE TABLE IF NOT EXISTS job_files (
+    job_id TEXT NOT NULL,
+    file TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    hash_count INTEGER,
+    source TEXT
+);
+CREATE INDEX IF NOT EXISTS job_files_job_id ON job_files (job_id);
+CREATE INDEX IF NOT EXISTS job_files_file_name ON job_files (file_name);
+CREATE INDEX IF NOT EXISTS job_files_source ON job_files (source);
+"""
+
+def connect():
+    os.makedirs(os.path.dirname(jobstore_path), exist_ok=True)
+    # Concurrent submissions wait for each other's write lock instead of failing
+    connection = sqlite3.connect(jobstore_path, timeout=30)
+    connection.row_factory = sqlite3.Row
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    _migrate_columns(connection)
+    has_job_files = connection.execute("SELECT 1 FROM sqlite_master WHERE name = 'job_files'").fetchone()
+    connection.executescript(schema)
+    if not has_job_files:
+        # Jobs submitted before grouping cracked a single file
+        with connection:
+            connection.execute("INSERT INTO job_files (job_id, file, file_name, hash_count) SELECT id, file, file_name, hash_count FROM jobs")
+    _migrate_legacy_jobs(connection)
+    return connection
+
+def _migrate_columns(connection):
+    """Add the columns introduced after a job store was created."""
+    columns = {row[1] for row in connection.execute("PRAGMA table_info(jobs)")}
+    if not columns:
+        return
+    new_columns = {'hash_mode': 'INTEGER', 'hash_count': 'INTEGER', 'salt_count': 'INTEGER', 'candidates': 'INTEGER', 'wordlist_size': 'INTEGER', 'backend': 'TEXT',
+                   'priority': 'TEXT', 'share': 'TEXT', 'spec': 'TEXT', 'claimed_at': 'INTEGER'}
+    for column, column_type in new_columns.items():
+        if column not in columns:
+            connection.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+    file_columns = {row[1] for row in connection.execute("PRAGMA table_info(job_files)")}
+    if file_columns and 'source' not in file_columns:
+        connection.execute("ALTER TABLE job_files ADD COLUMN source TEXT")
+
+def _migrate_legacy_jobs(connection):
+    """Import the jobs of the former build/jobs.json file once."""
+    if not os.path.exists(legacy_jobs_path):
+        return
+    try:
+        with open(legacy_jobs_path, 'r') as file:
+            jobs = json.load(file)
+    except:
+        jobs = []
+    with connection:
+        connection.executemany(
+            "INSERT OR IGNORE INTO jobs (id, file, file_name, shards, submitted) VALUES (?, ?, ?, ?, ?)",
+            [(j['id'], j['file'], j['file'].split('/')[-1], j.get('shards', 1), j.get('submitted')) for j in jobs]
+        )
+        connection.executemany(
+            "INSERT INTO job_files (job_id, file, file_name) VALUES (?, ?, ?)",
+            [(j['id'], j['file'], j['file'].split('/')[-1]) for j in jobs]
+        )
+    os.replace(legacy_jobs_path, f"{legacy_jobs_path}.migrated")
+
+def _to_dict(row):
+    job = dict(row)
+    job['details'] = json.loads(job['details']) if job['details'] else {}
+    job['spec'] = json.loads(job['spec']) if job.get('spec') else None
+    return job
+
+def add_job(job_id, file, wordlist, options, vcpu, memory, shards, submitted,
+            hash_mode=None, hash_count=None, salt_count=None, candidates=None, files=None, backend=None,
+            priority=None, share=None, spec=None, file_name=None, wordlist_size=None):
+    """
+    Record a submitted job. files lists the (path, hash count, source name) of every hash file cracked by
+    the job, the source being the name of the file a list split per mode comes from. It defaults to the
+    single file of the job. file_name is the name the job uploads its results under,
+    the name of the file by default. A job given the spec of its submission is recorded as held until
+    admission submits it.
+    """
+    files = files or [(file, hash_count, file.split('/')[-1])]
+    connection = connect()
+    with connection:
+        connection.executemany(
+            "INSERT INTO job_files (job_id, file, file_name, hash_count, source) VALUES (?, ?, ?, ?, ?)",
+            [(job_id, path, path.split('/')[-1], count, source) for path, count, source in files]
+        )
+        connection.execute(
+            "INSERT INTO jobs (id, file, file_name, wordlist, options, vcpu, memory, shards, submitted, "
+            "hash_mode, hash_count, salt_count, candidates, wordlist_size, backend, priority, share, spec, status) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, file, file_name or file.split('/')[-1], wordlist, options, vcpu, memory, shards, submitted,
+             hash_mode, hash_count, salt_count, candidates, wordlist_size, backend, priority, share,
+             json.dumps(spec) if spec else None, 'HELD' if spec else 'SUBMITTED')
+        )
+    connection.close()
+
+def claim_held_job(job_id):
+    """Mark a held job as being submitted, returns False when another process claimed it first."""
+    connection = connect()
+    with connection:
+        claimed = connection.execute(
+            "UPDATE jobs SET status = 'ADMITTING', claimed_at = ? WHERE id = ? AND status = 'HELD'",
+            (int(time.time() * 1000), job_id)
+        ).rowcount
+    connection.close()
+    return claimed == 1
+
+def release_held_job(job_id):
+    """Hold a claimed job again after its submission failed."""
+    connection = connect()
+    with connection:
+        connection.execute("UPDATE jobs SET status = 'HELD', claimed_at = NULL WHERE id = ? AND status = 'ADMITTING'", (job_id,))
+    connection.close()
+
+def release_stale_claims(timeout=claim_timeout):
+    """Hold again the jobs claimed longer than timeout milliseconds ago, their process died while submitting them."""
+    connection = connect()
+    with connection:
+        released = connection.execute(
+            "UPDATE jobs SET status = 'HELD', claimed_at = NULL WHERE status = 'ADMITTING' AND COALESCE(claimed_at, 0) < ?",
+            (int(time.time() * 1000) - timeout,)
+        ).rowcount
+    connection.close()
+    return released
+
+def admit_job(held_id, job_id):
+    """Replace the placeholder ID of a held job with the ID it was submitted under."""
+    connection = connect()
+    with connection:
+        connection.execute("UPDATE jobs SET id = ?, status = 'SUBMITTED', spec = NULL, claimed_at = NULL WHERE id = ?", (job_id, held_id))
+        connection.execute("UPDATE job_files SET job_id = ? WHERE job_id = ?", (job_id, held_id))
+    connection.close()
+
+def get_jobs(statuses=None, since=None, file_pattern=None, live=False):
+    """
+    Return jobs in submission order, optionally restricted to some statuses, to jobs submitted after
+    a timestamp in milliseconds, to file names matching a glob pattern, or to jobs not finished yet.
+    """
+    clauses = []
+    params = []
+    if statuses:
+        clauses.append(f"status IN ({', '.join('?' * len(statuses))})")
+        params.extend(statuses)
+    if live:
+        clauses.append(f"(status IS NULL OR status NOT IN ({', '.join('?' * len(terminal_statuses))}))")
+        params.extend(terminal_statuses)
+    if since:
+        clauses.append("COALESCE(submitted, created_at, 0) >= ?")
+        params.append(since)
+    if file_pattern:
+        clauses.append("id IN (SELECT job_id FROM job_files WHERE file_name GLOB ? OR source GLOB ?)")
+        params.extend([file_pattern, file_pattern])
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+    connection = connect()
+    jobs = [_to_dict(row) for row in connection.execute(f"SELECT * FROM jobs {where} ORDER BY rowid", params)]
+    connection.close()
+    return jobs
+
+def get_job_files(job_ids=None, file_pattern=None):
+    """
+    Return the hash files of jobs with their job ID, shard count, hash mode and the name the job uploads
+    the results it cannot attribute to a file under, optionally filtered.
+    """
+    clauses = []
+    params = []
+    if job_ids is not None:
+        clauses.append(f"f.job_id IN ({', '.join('?' * len(job_ids))})")
+        params.extend(job_ids)
+    if file_pattern:
+        # Lists split per mode are found by the name of the file they come from too
+        clauses.append("(f.file_name GLOB ? OR f.source GLOB ?)")
+        params.extend([file_pattern, file_pattern])
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+    connection = connect()
+    files = [dict(row) for row in connection.execute(
+        f"SELECT f.job_id, f.file, f.file_name, f.hash_count, j.shards, j.hash_mode, j.file_name AS job_file_name FROM job_files f JOIN jobs j ON j.id = f.job_id {where} ORDER BY f.rowid",
+        params
+    )]
+    connection.close()
+    return files
+
+def update_statuses(job_statuses):
+    """Store the last known state of jobs from describe_jobs records keyed by job ID."""
+    connection = connect()
+    with connection:
+        connection.executemany(
+            "UPDATE jobs SET status = ?, created_at = ?, started_at = ?, stopped_at = ?, details = ? WHERE id = ?",
+            [
+                (
+                    js['status'], js.get('createdAt'), js.get('startedAt'), js.get('stoppedAt'),
+                    json.dumps({'arrayProperties': js['arrayProperties']}) if 'arrayProperties' in js else None,
+                    job_id
+                )
+                for job_id, js in job_statuses.items()
+            ]
+        )
+    connection.close()
+
+def mark_unknown(job_ids):
+    """Mark jobs their backend no longer describes as UNKNOWN, keeping their last known times."""
+    connection = connect()
+    with connection:
+        connection.executemany("UPDATE jobs SET status = 'UNKNOWN' WHERE id = ?", [(job_id,) for job_id in job_ids])
+    connection.close()
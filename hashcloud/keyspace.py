@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# File name          : keyspace.py
+# Author             : TomPh
+# Date created       : 29 May 2023
+
+import math
+import re
+
+builtin_charsets = {
+    'l': b'abcdefghijklmnopqrstuvwxyz',
+    'u': b'ABCDEFGHIJKLMNOPQRSTUVWXYZ',
+    'd': b'0123456789',
+    'h': b'0123456789abcdef',
+    'H': b'0123456789ABCDEF',
+    's': b' !"#$%&\'()*+,-./:;<=>?@[\\]^_`{|}~',
+    'b': bytes(range(256)),
+}
+builtin_charsets['a'] = builtin_charsets['l'] + builtin_charsets['u'] + builtin_charsets['d'] + builtin_charsets['s']
+
+# Modes hashed outside the kernel, where hashcat amplifies masks by their first position only.
+slow_modes = {
+    400, 500, 1500, 1600, 1800, 2100, 2500, 3200, 5200, 6211, 6800, 7100, 7400, 7900, 9400, 9500, 9600,
+    10000, 10900, 11600, 12100, 13000, 13400, 22000, 22001,
+}
+# Modes hashing UTF-16 candidates, where hashcat keeps more mask positions in the kernel.
+utf16_modes = {1000, 1430, 1440, 1730, 1740, 5500, 5600, 13100, 18200}
+
+def attack_mode(options):
+    """Return the hashcat -a value from the option string, hashcat defaults to a straight wordlist attack."""
+    match = re.search(r'(?:^|\s)(?:-a|--attack-mode)[\s=]?(\d+)', options)
+    return int(match.group(1)) if match else 0
+
+def custom_charsets(options):
+    """Return the custom charsets -1 to -4 defined in the option string, keyed by their number."""
+    charsets = {}
+    for match in re.finditer(r'(?:^|\s)(?:-([1-4])|--custom-charset([1-4]))[\s=](\S+)', options):
+        number = match.group(1) or match.group(2)
+        charsets[number] = parse_charset(match.group(3), charsets)
+    return charsets
+
+def parse_charset(charset, custom=None):
+    """Return the distinct bytes of a charset made of literal characters and ?x placeholders."""
+    return bytes(sorted(set(b''.join(parse_mask(charset, custom)))))
+
+def parse_mask(mask, custom=None):
+    """Split a mask into the set of bytes allowed at each position."""
+    custom = custom or {}
+    data = mask.encode()
+    positions = []
+    i = 0
+    while i < len(data):
+        if data[i:i + 1] == b'?':
+            if i + 1 == len(data):
+                raise ValueError(f"Mask '{mask}' ends with a lone '?'.")
+            placeholder = chr(data[i + 1])
+            if placeholder == '?':
+                positions.append(b'?')
+            elif placeholder in builtin_charsets:
+                positions.append(builtin_charsets[placeholder])
+            elif placeholder in custom:
+                positions.append(custom[placeholder])
+            else:
+                raise ValueError(f"Unknown charset '?{placeholder}' in mask '{mask}'.")
+            i += 2
+        else:
+            positions.append(data[i:i + 1])
+            i += 1
+    return positions
+
+def amplified_positions(counts, mode):
+    """
+    Number of leading mask positions hashcat loops over inside the kernel, mirroring how it splits a
+    mask between the amplifier and the base words counted by --keyspace, --skip and --limit
+    (mp_css_split_cnt in hashcat's mpsp.c).
+    """
+    if mode in slow_modes:
+        return 1
+    if len(counts) < 6:
+        return 1
+    if len(counts) == 6:
+        return 2
+    if mode in utf16_modes:
+        return 5 if len(counts) in (8, 10) else 4
+    return 3 if counts[0] * counts[1] > 256 else 4
+
+def mask_keyspace(mask, options, mode):
+    """Return (base, total) for a mask attack: the keyspace hashcat reports and the number of candidates."""
+    counts = [len(position) for position in parse_mask(mask, custom_charsets(options))]
+    total = math.prod(counts)
+    return math.prod(counts[min(amplified_positions(counts, mode), len(counts)):]), total
+
+def get_slices(base, slices):
+    """Split a base keyspace into even (skip, limit) slices."""
+    slices = max(1, min(slices, base))
+    return [(base * i // slices, base * (i + 1) // slices - base * i // slices) for i in range(slices)]
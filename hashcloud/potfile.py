@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# File name          : potfile.py
+# Author             : TomPh
+# Date created       : 29 May 2023
+
+import os
+import re
+import sqlite3
+
+from hashcloud import ingest
+
+potfile_path = 'build/potfile.db'
+
+# Number of rows sent to SQLite per executemany call.
+batch_size = 50000
+
+def connect():
+    os.makedirs(os.path.dirname(potfile_path), exist_ok=True)
+    connection = sqlite3.connect(potfile_path)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS cracked (hash BLOB PRIMARY KEY, plain BLOB NOT NULL) WITHOUT ROWID"
+    )
+    return connection
+
+def hash_key(hash_value):
+    """Key a hash is stored and looked up under: hex digests are compared case-insensitively, as hashcat does."""
+    return hash_value.lower() if re.fullmatch(rb'[0-9a-fA-F]+', hash_value) else hash_value
+
+def split_result(line, mode=None):
+    """
+    Split a hashcat output line into its hash and plain parts. The plain text can contain colons, so
+    every prefix ending before one is tried, longest first, against the format of the mode, or against
+    every known format without one. Hashes of no known format end at the last ':'.
+    """
+    pattern = ingest.mode_patterns.get(mode)
+    position = len(line)
+    while (position := line.rfind(b':', 0, position)) != -1:
+        hash_value = line[:position]
+        if (pattern.fullmatch(hash_value) if pattern else ingest.detect(hash_value) is not None):
+            return hash_key(hash_value), line[position + 1:]
+    hash_value, separator, plain = line.rpartition(b':')
+    if not separator:
+        return None
+    return hash_key(hash_value), plain
+
+def _batches(rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def add_results(lines, mode=None):
+    """Store hashcat output lines of a hash mode in the potfile, returns the number of new entries."""
+    connection = connect()
+    added = 0
+    with connection:
+        before = connection.total_changes
+        rows = (split_result(line.rstrip(b'\r\n'), mode) for line in lines)
+        for batch in _batches(row for row in rows if row):
+            connection.executemany("INSERT OR IGNORE INTO cracked (hash, plain) VALUES (?, ?)", batch)
+        added = connection.total_changes - before
+    connection.close()
+    return added
+
+def partition(hashes, username=False):
+    """
+    Split hash lines into the ones still to crack and the (hash, plain) pairs already in the potfile.
+    With username, lines are user:hash and only the hash is looked up. The order of the lines to crack
+    is preserved.
+    """
+    connection = connect()
+    connection.execute("CREATE TEMP TABLE input (line BLOB, hash BLOB)")
+    keys = ((line, hash_key(line.split(b':', 1)[-1] if username else line)) for line in hashes)
+    for batch in _batches(keys):
+        connection.executemany("INSERT INTO input (line, hash) VALUES (?, ?)", batch)
+    remaining = [row[0] for row in connection.execute(
+        "SELECT i.line FROM input i LEFT JOIN cracked c ON c.hash = i.hash WHERE c.hash IS NULL ORDER BY i.rowid"
+    )]
+    known = connection.execute(
+        "SELECT DISTINCT c.hash, c.plain FROM input i JOIN cracked c ON c.hash = i.hash"
+    ).fetchall()
+    connection.close()
+    return remaining, known
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# File name          : prepare.py
+# Author             : TomPh
+# Date created       : 29 May 2023
+
+import heapq
+import os
+import struct
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+# Input bytes handled by a worker at once, this bounds the memory used per core.
+chunk_size = 64 * 1024 * 1024
+# Maximum number of run files merged in a single pass.
+max_open_runs = 256
+
+# Run files store (length, count) headers followed by the candidate bytes.
+record_header = struct.Struct('>IQ')
+
+def normalize(line):
+    """Strip line endings and trailing whitespace from a candidate."""
+    return line.rstrip()
+
+def _write_run(path, records):
+    with open(path, 'wb') as file:
+        for line, count in records:
+            file.write(record_header.pack(len(line), count))
+            file.write(line)
+
+def _read_run(path):
+    with open(path, 'rb', buffering=1024 * 1024) as file:
+        while True:
+            header = file.read(record_header.size)
+            if not header:
+                return
+            length, count = record_header.unpack(header)
+            yield file.read(length), count
+
+def _sort_chunk(path, start, end, run_path):
+    """Normalize, count and sort one line-aligned chunk of the input into a run file."""
+    counts = {}
+    lines = 0
+    with open(path, 'rb') as file:
+        file.seek(start)
+        for line in file.read(end - start).split(b'\n'):
+            line = normalize(line)
+            if not line:
+                continue
+            lines += 1
+            counts[line] = counts.get(line, 0) + 1
+    _write_run(run_path, sorted(counts.items()))
+    return run_path, lines
+
+def line_chunks(path, size, chunk_size=chunk_size):
+    """Split a file into (start, end) offsets of chunks of about chunk_size bytes ending on a line break."""
+    offsets = [0]
+    with open(path, 'rb') as file:
+        while offsets[-1] < size:
+            file.seek(min(offsets[-1] + chunk_size, size))
+            file.readline()
+            offsets.append(min(file.tell(), size))
+    return list(zip(offsets[:-1], offsets[1:]))
+
+def _merge_counts(runs):
+    """Merge sorted runs, summing the counts of identical candidates."""
+    current, total = None, 0
+    for line, count in heapq.merge(*[_read_run(run) for run in runs]):
+        if line == current:
+            total += count
+            continue
+        if current is not None:
+            yield current, total
+        current, total = line, count
+    if current is not None:
+        yield current, total
+
+def _merge_runs(runs, tmp_dir):
+    # Reduce the number of runs until they can all be opened at once.
+    generation = 0
+    while len(runs) > max_open_runs:
+        merged = []
+        for i in range(0, len(runs), max_open_runs):
+            run_path = os.path.join(tmp_dir, f"merge_{generation}_{i}.run")
+            _write_run(run_path, _merge_counts(runs[i:i + max_open_runs]))
+            merged.append(run_path)
+        for run in runs:
+            os.remove(run)
+        runs = merged
+        generation += 1
+    return _merge_counts(runs)
+
+def _frequency_runs(records, tmp_dir):
+    """Spill (count, candidate) records into runs sorted by decreasing frequency."""
+    runs = []
+    batch = []
+    batch_size = 0
+    for line, count in records:
+        batch.append((line, count))
+        batch_size += len(line) + 64
+        if batch_size >= chunk_size:
+            runs.append(_spill_by_frequency(batch, tmp_dir, len(runs)))
+            batch, batch_size = [], 0
+    if batch:
+        runs.append(_spill_by_frequency(batch, tmp_dir, len(runs)))
+    return runs
+
+def _spill_by_frequency(batch, tmp_dir, index):
+    run_path = os.path.join(tmp_dir, f"frequency_{index}.run")
+    batch.sort(key=lambda record: (-record[1], record[0]))
+    _write_run(run_path, batch)
+    return run_path
+
+def prepare(path, out_path, frequency=False, workers=None, tmp_dir=None):
+    """
+    Deduplicate and normalize a wordlist with an external merge sort.
+    Memory use is bounded by chunk_size per worker, whatever the size of the input.
+    Candidates are written sorted, or by decreasing number of occurrences if frequency is set.
+    Returns a dict of statistics about the input and output.
+    """
+    size = os.path.getsize(path)
+    workers = workers or os.cpu_count()
+    stats = {'input_bytes': size, 'input_lines': 0, 'output_bytes': 0, 'output_lines': 0}
+
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as work_dir:
+        chunks = line_chunks(path, size)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(_sort_chunk, path, start, end, os.path.join(work_dir, f"chunk_{i}.run"))
+                for i, (start, end) in enumerate(chunks)
+            ]
+            runs = []
+            for future in futures:
+                run_path, lines = future.result()
+                runs.append(run_path)
+                stats['input_lines'] += lines
+
+        records = _merge_runs(runs, work_dir)
+        if frequency:
+            # Candidates are unique at this point, a second sort orders them by frequency.
+            frequency_runs = _frequency_runs(records, work_dir)
+            records = heapq.merge(
+                *[_read_run(run) for run in frequency_runs],
+                key=lambda record: (-record[1], record[0])
+            )
+
+        with open(out_path, 'wb', buffering=1024 * 1024) as file:
+            for line, count in records:
+                file.write(line + b'\n')
+                stats['output_lines'] += 1
+                stats['output_bytes'] += len(line) + 1
+
+    return stats
@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# File name          : settings.py
+# Author             : TomPh
+# Date created       : 29 May 2023
+
+import functools
+import json
+
+config_path = 'config.json'
+resources_path = 'build/resources.json'
+
+def _load(path):
+    try:
+        with open(path, 'r') as file:
+            return json.load(file)
+    except:
+        return None
+
+@functools.lru_cache(maxsize=None)
+def load_config():
+    """Return config.json, read once per process. Empty if there is no config file."""
+    return _load(config_path) or {}
+
+@functools.lru_cache(maxsize=None)
+def load_resources():
+    """Return build/resources.json, read once per process. Empty if setup has not been run."""
+    return _load(resources_path) or {}
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# File name          : sizing.py
+# Author             : TomPh
+# Date created       : 29 May 2023
+
+import json
+import math
+import os
+import re
+import statistics
+
+from hashcloud import settings
+
+throughput_path = 'build/throughput.json'
+# Number of finished jobs kept per hash mode to estimate its throughput.
+max_samples = 50
+# Shorter jobs are dominated by startup and download time and say little about hashing speed.
+min_sample_seconds = 300
+
+# Valid Fargate memory values in MB for each vCPU value.
+fargate_sizes = [
+    (0.25, [512, 1024, 2048]),
+    (0.5, list(range(1024, 4097, 1024))),
+    (1, list(range(2048, 8193, 1024))),
+    (2, list(range(4096, 16385, 1024))),
+    (4, list(range(8192, 30721, 1024))),
+    (8, list(range(16384, 61441, 4096))),
+    (16, list(range(32768, 122881, 8192))),
+]
+
+# Rough CPU throughput in candidates (times salts) per second and per vCPU, used until jobs have been measured.
+default_throughput = {
+    0: 50e6,       # MD5
+    100: 25e6,     # SHA1
+    1000: 80e6,    # NTLM
+    1400: 10e6,    # SHA2-256
+    1700: 3e6,     # SHA2-512
+    5500: 30e6,    # NetNTLMv1
+    5600: 5e6,     # NetNTLMv2
+    13100: 1e6,    # Kerberos 5 TGS-REP etype 23
+    18200: 1e6,    # Kerberos 5 AS-REP etype 23
+    500: 20e3,     # md5crypt
+    1800: 1e3,     # sha512crypt
+    3200: 300,     # bcrypt
+    22000: 20e3,   # WPA-PBKDF2-PMKID+EAPOL
+}
+fallback_throughput = 1e6
+
+# Modes where every hash is cracked in a single pass, whatever their number.
+unsalted_modes = {0, 100, 300, 900, 1000, 1300, 1400, 1700, 3000, 10800, 17400, 17600}
+
+# Fixed time for scheduling, image pull and wordlist download, in seconds.
+startup_seconds = 90
+download_bytes_per_second = 50e6
+
+def hash_mode(options):
+    """Return the hashcat -m value from the option string, hashcat defaults to MD5."""
+    match = re.search(r'(?:^|\s)(?:-m|--hash-type)[\s=]?(\d+)', options)
+    return int(match.group(1)) if match else 0
+
+def salt_count(mode, hashes):
+    """Estimate the number of distinct salts, each salted hash is assumed to have its own."""
+    if mode in unsalted_modes:
+        return 1
+    return len(set(hashes))
+
+def _load_samples():
+    try:
+        with open(throughput_path, 'r') as file:
+            return json.load(file)
+    except:
+        return {}
+
+def record_jobs(jobs):
+    """
+    Learn throughput from finished jobs: work done per second and per vCPU, kept by hash mode.
+    Array jobs carry the runtimes of their children in child_runtimes.
+    """
+    samples = _load_samples()
+    changed = False
+    for j in jobs:
+        if j.get('status') != 'SUCCEEDED' or not j.get('started_at') or not j.get('candidates') or not j.get('vcpu'):
+            continue
+        # Jobs run on the local machine say nothing about the speed of Fargate tasks
+        if j.get('backend') == 'local':
+            continue
+        shards = j['shards'] or 1
+        runtimes = j.get('child_runtimes') or [(j['stopped_at'] - j['started_at']) / 1000]
+        if max(runtimes) < min_sample_seconds:
+            continue
+        # Runtimes include the startup and download time estimate_seconds adds back, only hashing is measured
+        overhead = startup_seconds + (j.get('wordlist_size') or 0) / shards / download_bytes_per_second
+        hashing = sum(max(runtime - overhead, 0) for runtime in runtimes)
+        if not hashing:
+            continue
+        mode_samples = samples.setdefault(str(j['hash_mode']), [])
+        work = j['candidates'] * (j['salt_count'] or 1) * len(runtimes) / shards
+        mode_samples.append(work / (hashing * j['vcpu']))
+        del mode_samples[:-max_samples]
+        changed = True
+    if changed:
+        os.makedirs(os.path.dirname(throughput_path), exist_ok=True)
+        with open(throughput_path, 'w') as file:
+            json.dump(samples, file)
+
+def throughput(mode):
+    """Return the learned throughput of a hash mode per vCPU, or the default one if it was never measured."""
+    mode_samples = _load_samples().get(str(mode))
+    if mode_samples:
+        return statistics.median(mode_samples)
+    return default_throughput.get(mode, fallback_throughput)
+
+def estimate_seconds(mode, candidates, salts, wordlist_size, vcpu, shards=1):
+    work = candidates * salts / shards
+    return startup_seconds + wordlist_size / shards / download_bytes_per_second + work / (throughput(mode) * vcpu)
+
+def required_memory(hash_count):
+    """Memory in MB needed by hashcat, with room for its tables and the hash list."""
+    return 1024 + hash_count * 512 // (1024 * 1024)
+
+def choose_size(mode, candidates, salts, hash_count, wordlist_size, shards=1):
+    """
+    Pick the smallest valid Fargate vCPU/memory combination that finishes within the target runtime,
+    or the largest one if none does. Returns (vcpu, memory).
+    """
+    target_seconds = settings.load_config().get('TARGET_RUNTIME_MINUTES', 60) * 60
+    memory_needed = required_memory(hash_count)
+    candidates_sizes = [
+        (vcpu, next(m for m in memories if m >= memory_needed))
+        for vcpu, memories in fargate_sizes
+        if memories[-1] >= memory_needed
+    ]
+    for vcpu, memory in candidates_sizes:
+        if estimate_seconds(mode, candidates, salts, wordlist_size, vcpu, shards) <= target_seconds:
+            return vcpu, memory
+    return candidates_sizes[-1]
+
+def choose_shards(mode, candidates, salts, vcpu, max_shards):
+    """Smallest number of parallel tasks that finishes within the target runtime, capped at max_shards."""
+    target_seconds = settings.load_config().get('TARGET_RUNTIME_MINUTES', 60) * 60
+    work_seconds = candidates * salts / (throughput(mode) * vcpu)
+    if target_seconds <= startup_seconds:
+        return max_shards
+    return max(1, min(max_shards, math.ceil(work_seconds / (target_seconds - startup_seconds))))
+
+def estimate_cost(seconds, vcpu, memory, shards=1):
+    """Fargate Spot cost in USD of running the job, prices can be overridden in config.json."""
+    config = settings.load_config()
+    vcpu_hour = config.get('VCPU_HOUR_PRICE', 0.01334058)
+    gb_hour = config.get('GB_HOUR_PRICE', 0.00146489)
+    hours = seconds / 3600
+    return shards * hours * (vcpu * vcpu_hour + memory / 1024 * gb_hour)
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# File name          : transfer.py
+# Author             : TomPh
+# Date created       : 29 May 2023
+
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from hashcloud import clients
+from hashcloud import settings
+
+s3 = clients.LazyClient('s3')
+
+checkpoint_folder = 'build/uploads'
+digest_metadata_key = 'sha256'
+
+# S3 limits for multipart uploads
+min_part_size = 5 * 1024 * 1024
+max_parts = 10000
+
+part_size = settings.load_config().get('UPLOAD_PART_SIZE_MB', 64) * 1024 * 1024
+concurrency = settings.load_config().get('UPLOAD_CONCURRENCY', 8)
+
+def file_digest(path, block_size=8 * 1024 * 1024):
+    """Compute the SHA-256 of a local file in a single streaming pass."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def remote_digest(bucket_name, key):
+    """Return the digest stored on an S3 object, or None if the object does not exist."""
+    try:
+        response = s3.head_object(Bucket=bucket_name, Key=key)
+    except s3.exceptions.ClientError:
+        return None
+    return response.get('Metadata', {}).get(digest_metadata_key)
+
+def _checkpoint_path(bucket_name, key):
+    return os.path.join(checkpoint_folder, f"{bucket_name}_{key.replace('/', '_')}.json")
+
+def _load_checkpoint(path, digest, size):
+    try:
+        with open(path, 'r') as file:
+            checkpoint = json.load(file)
+    except:
+        return None
+    if checkpoint.get('digest') != digest or checkpoint.get('size') != size:
+        return None
+    return checkpoint
+
+def _save_checkpoint(path, checkpoint):
+    # Write then rename so an interrupted save never corrupts the checkpoint.
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as file:
+        json.dump(checkpoint, file)
+    os.replace(tmp_path, path)
+
+def _upload_part(path, bucket_name, key, upload_id, part_number, offset, length):
+    with open(path, 'rb') as file:
+        file.seek(offset)
+        body = file.read(length)
+    response = s3.upload_part(
+        Bucket=bucket_name,
+        Key=key,
+        UploadId=upload_id,
+        PartNumber=part_number,
+        Body=body
+    )
+    return part_number, response['ETag']
+
+def upload_file(path, bucket_name, key, part_size=part_size, concurrency=concurrency, metadata=None, digest=None):
+    """
+    Upload a file with parallel multipart transfers.
+    Completed parts are checkpointed to build/ so an interrupted upload resumes where it stopped,
+    and the upload is skipped entirely when the object already holds the same content.
+    The digest can be passed in when the caller already computed it.
+    Returns True if data was transferred, False if the upload was skipped.
+    """
+    size = os.path.getsize(path)
+    digest = digest or file_digest(path)
+    if remote_digest(bucket_name, key) == digest:
+        print(f"s3://{bucket_name}/{key} is already up to date, skipping upload.")
+        return False
+
+    os.makedirs(checkpoint_folder, exist_ok=True)
+    checkpoint_path = _checkpoint_path(bucket_name, key)
+    checkpoint = _load_checkpoint(checkpoint_path, digest, size)
+
+    if checkpoint is None:
+        part_size = max(part_size, min_part_size, -(-size // max_parts))
+        object_metadata = dict(metadata or {})
+        object_metadata[digest_metadata_key] = digest
+        response = s3.create_multipart_upload(Bucket=bucket_name, Key=key, Metadata=object_metadata)
+        checkpoint = {
+            'upload_id': response['UploadId'],
+            'digest': digest,
+            'size': size,
+            'part_size': part_size,
+            'parts': {}
+        }
+        _save_checkpoint(checkpoint_path, checkpoint)
+    else:
+        part_size = checkpoint['part_size']
+        print(f"Resuming upload, {len(checkpoint['parts'])} parts already transferred.")
+
+    upload_id = checkpoint['upload_id']
+    part_count = max(1, -(-size // part_size))
+    pending = [n for n in range(1, part_count + 1) if str(n) not in checkpoint['parts']]
+
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [
+                executor.submit(
+                    _upload_part, path, bucket_name, key, upload_id, n,
+                    (n - 1) * part_size, min(part_size, size - (n - 1) * part_size)
+                )
+                for n in pending
+            ]
+            error = None
+            for future in as_completed(futures):
+                # Keep checkpointing the parts that succeed even once one has failed.
+                try:
+                    part_number, etag = future.result()
+                except Exception as e:
+                    error = error or e
+                    continue
+                checkpoint['parts'][str(part_number)] = etag
+                _save_checkpoint(checkpoint_path, checkpoint)
+                print(f"Uploaded part {len(checkpoint['parts'])}/{part_count}", end='\r')
+        print()
+        if error:
+            raise error
+    except s3.exceptions.NoSuchUpload:
+        # The multipart upload expired or was aborted, start over.
+        print("Previous upload is no longer available, restarting.")
+        os.remove(checkpoint_path)
+        return upload_file(path, bucket_name, key, part_size, concurrency, metadata, digest)
+
+    parts = [{'PartNumber': int(n), 'ETag': etag} for n, etag in checkpoint['parts'].items()]
+    parts.sort(key=lambda p: p['PartNumber'])
+    s3.complete_multipart_upload(
+        Bucket=bucket_name,
+        Key=key,
+        UploadId=upload_id,
+        MultipartUpload={'Parts': parts}
+    )
+    os.remove(checkpoint_path)
+    return True
@@ -4,36 +4,96 @@
 # Author             : TomPh
 # Date created       : 29 May 2023
 
-import boto3
 import json
+import os
 
-s3 = boto3.client('s3')
+from tabulate import tabulate
 
-wordlist_folder = 'passlists'
-bucket_name = None
+from hashcloud import catalog
+from hashcloud import chunking
+from hashcloud import clients
+from hashcloud import compression
+from hashcloud import prepare
+from hashcloud import settings
+from hashcloud import transfer
+
+s3 = clients.LazyClient('s3')
 
-try:
-    with open('build/resources.json', 'r') as file:
-        created_resources = json.load(file)
-        bucket_name = created_resources.get('bucket_name')
-except:
-    pass
+wordlist_folder = 'passlists'
+index_folder = 'indexes'
+bucket_name = settings.load_resources().get('bucket_name')
 
 def list_wordlists(**kwargs):
     if not bucket_name:
         print("Missing resources, run the setup command first.")
         return
-    response = s3.list_objects_v2(Bucket=bucket_name, Prefix=wordlist_folder)
-    if response['KeyCount'] > 0:
-        for obj in response['Contents']:
-            print(obj['Key'].split('/')[-1])
+    wordlists = catalog.get_wordlists(bucket_name)
+    if wordlists:
+        rows = [[name, entry['size'], entry.get('lines', '-')] for name, entry in sorted(wordlists.items())]
+        print(tabulate(rows, headers=['Wordlist', 'Size', 'Lines']))
     else:
         print("No wordlists availale")
 
-def upload_wordlist(f, **kwargs):
+def upload_wordlist(f, part_size=None, concurrency=None, compress=None, chunked=False, **kwargs):
     if not bucket_name:
         print("Missing resources, run the setup command first.")
         return
     file_name = f.split('/')[-1]
-    res = s3.upload_file(f, bucket_name, f"{wordlist_folder}/{file_name}")
-    print(f"File uploaded successfully to s3://{bucket_name}/{wordlist_folder}/{file_name}")
\ No newline at end of file
+    # Size, line count, checksum and length histogram of the raw list, computed in one pass
+    entry = catalog.scan_wordlist(f)
+    if chunked:
+        upload_chunked_wordlist(f, file_name, entry, compress, concurrency)
+        return
+    if compress:
+        # Compress into framed, seekable form and upload the frame index next to it
+        file_name += compression.extensions[compress]
+        compressed_path = f"build/{file_name}"
+        os.makedirs('build', exist_ok=True)
+        frames = compression.compress_file(f, compressed_path, compress)
+        s3.put_object(
+            Bucket=bucket_name,
+            Key=f"{index_folder}/{file_name}.json",
+            Body=json.dumps({'codec': compress, 'frames': frames}).encode()
+        )
+        original_size = os.path.getsize(f)
+        compressed_size = os.path.getsize(compressed_path)
+        print(f"Compressed {original_size} bytes to {compressed_size} bytes ({len(frames)} frames).")
+        f = compressed_path
+    transfer_args = {}
+    if part_size:
+        transfer_args['part_size'] = part_size * 1024 * 1024
+    if concurrency:
+        transfer_args['concurrency'] = concurrency
+    try:
+        if not compress:
+            transfer_args['digest'] = entry['sha256']
+        if transfer.upload_file(f, bucket_name, f"{wordlist_folder}/{file_name}", **transfer_args):
+            print(f"File uploaded successfully to s3://{bucket_name}/{wordlist_folder}/{file_name}")
+        entry['raw_size'] = entry['size']
+        entry['size'] = os.path.getsize(f)
+        entry['codec'] = compress
+        catalog.update_manifest(bucket_name, file_name, entry)
+    finally:
+        if compress:
+            os.remove(f)
+
+def upload_chunked_wordlist(f, file_name, entry, compress=None, concurrency=None):
+    """Upload a new version of a chunked wordlist, sending only the chunks the bucket does not have."""
+    version_key, chunk_count, sent_count, sent_bytes = chunking.upload_chunked(
+        f, bucket_name, file_name, entry, compress, concurrency or transfer.concurrency
+    )
+    print(f"{sent_count} new chunks of {chunk_count} uploaded ({sent_bytes} bytes).")
+    entry['raw_size'] = entry['size']
+    entry['codec'] = compress
+    entry['chunks'] = version_key
+    catalog.update_manifest(bucket_name, file_name, entry)
+    print(f"Wordlist '{file_name}' version {entry['sha256'][:16]} saved to s3://{bucket_name}/{version_key}")
+
+def prepare_wordlist(f, o=None, frequency=False, workers=None, tmp_dir=None, **kwargs):
+    out_path = o or f"{f}.prepared"
+    stats = prepare.prepare(f, out_path, frequency=frequency, workers=workers, tmp_dir=tmp_dir)
+    removed = stats['input_lines'] - stats['output_lines']
+    shrink = 100 * (1 - stats['output_bytes'] / stats['input_bytes']) if stats['input_bytes'] else 0
+    print(f"Candidates: {stats['input_lines']} -> {stats['output_lines']} ({removed} duplicates removed)")
+    print(f"Size: {stats['input_bytes']} -> {stats['output_bytes']} bytes ({shrink:.1f}% smaller)")
+    print(f"Prepared wordlist written to '{out_path}'.")
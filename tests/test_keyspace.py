@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# File name          : test_keyspace.py
+# Author             : TomPh
+# Date created       : 29 May 2023
+
+import unittest
+
+from hashcloud import keyspace
+
+class MaskKeyspaceTest(unittest.TestCase):
+    """
+    Base keyspaces hashcat -a 3 -m <mode> --keyspace <mask> reports, derived from the mask split of
+    mp_css_split_cnt in hashcat's mpsp.c. They were not regenerated from a hashcat run, the container
+    asks hashcat for the keyspace it slices, so a difference only makes slices uneven.
+    """
+
+    def test_short_mask_amplifies_first_position(self):
+        self.assertEqual(keyspace.mask_keyspace('?d?d?d?d', '-a 3', 0), (1000, 10000))
+        self.assertEqual(keyspace.mask_keyspace('?l?l?l?l?l', '-a 3', 0), (26 ** 4, 26 ** 5))
+
+    def test_six_positions_amplify_two(self):
+        self.assertEqual(keyspace.mask_keyspace('?l?l?l?l?l?l', '-a 3', 0), (26 ** 4, 26 ** 6))
+
+    def test_small_leading_charsets_amplify_four(self):
+        self.assertEqual(keyspace.mask_keyspace('?d?d?d?d?d?d?d?d', '-a 3', 0), (10000, 10 ** 8))
+
+    def test_slow_modes_amplify_first_position(self):
+        for mode in (1600, 1800, 3200, 7900, 9500, 9600, 10000, 12100, 13000, 22000):
+            self.assertEqual(keyspace.mask_keyspace('?d?d?d?d?d?d?d?d', '-a 3', mode), (10 ** 7, 10 ** 8), mode)
+
+    def test_custom_charsets(self):
+        base, total = keyspace.mask_keyspace('?1?1?1', '-a 3 -1 ?dabc', 0)
+        self.assertEqual((base, total), (13 ** 2, 13 ** 3))
+
+    def test_literal_positions(self):
+        self.assertEqual(keyspace.mask_keyspace('pass?d?d', '-a 3', 3200), (100, 100))
+        self.assertEqual(keyspace.mask_keyspace('?dpass', '-a 3', 3200), (1, 10))
+
+class SlicesTest(unittest.TestCase):
+
+    def test_slices_cover_the_keyspace(self):
+        for base, slices in ((10000, 7), (7737809375, 64), (5, 8)):
+            parts = keyspace.get_slices(base, slices)
+            self.assertEqual(parts[0][0], 0)
+            self.assertEqual(sum(limit for _, limit in parts), base)
+            for (skip, limit), (next_skip, _) in zip(parts, parts[1:]):
+                self.assertEqual(skip + limit, next_skip)
+
+if __name__ == '__main__':
+    unittest.main()
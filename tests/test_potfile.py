@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# File name          : test_potfile.py
+# Author             : TomPh
+# Date created       : 29 May 2023
+
+import os
+import tempfile
+import unittest
+
+from hashcloud import potfile
+
+md5_password = b'5f4dcc3b5aa765d61d8327deb882cf99'
+md5_test = b'098f6bcd4621d373cade4e832627b4f6'
+
+class PotfileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.potfile_path = potfile.potfile_path
+        potfile.potfile_path = os.path.join(self.directory.name, 'potfile.db')
+
+    def tearDown(self):
+        potfile.potfile_path = self.potfile_path
+        self.directory.cleanup()
+
+    def test_uppercase_hex_matches_cracked_hash(self):
+        potfile.add_results([md5_password + b':password\n'])
+        remaining, known = potfile.partition([md5_password.upper(), md5_test])
+        self.assertEqual(remaining, [md5_test])
+        self.assertEqual(known, [(md5_password, b'password')])
+
+    def test_username_lines_are_looked_up_by_hash(self):
+        potfile.add_results([md5_password + b':password\n'])
+        remaining, known = potfile.partition([b'alice:' + md5_password, b'bob:' + md5_test], username=True)
+        self.assertEqual(remaining, [b'bob:' + md5_test])
+        self.assertEqual(known, [(md5_password, b'password')])
+
+    def test_plain_with_colons(self):
+        self.assertEqual(potfile.split_result(md5_password + b':pa:ss'), (md5_password, b'pa:ss'))
+        self.assertEqual(potfile.split_result(md5_password + b':pa:ss', 0), (md5_password, b'pa:ss'))
+        potfile.add_results([md5_password + b':pa:ss\n'])
+        self.assertEqual(potfile.partition([md5_password])[1], [(md5_password, b'pa:ss')])
+
+    def test_hash_with_colons(self):
+        netntlmv2 = b'user::DOMAIN:1122334455667788:' + b'a' * 32 + b':0101000000'
+        self.assertEqual(potfile.split_result(netntlmv2 + b':pa:ss', 5600), (netntlmv2, b'pa:ss'))
+
+if __name__ == '__main__':
+    unittest.main()